@@ -0,0 +1,115 @@
+import os
+import json
+import threading
+
+# Name of the checkpoint journal kept in the output folder while an extraction runs
+JOURNAL_FILENAME = "media_extraction_journal.jsonl"
+JOURNAL_VERSION = 1
+
+class CheckpointJournal:
+    """
+    Append-only journal of the work an extraction run has completed.
+
+    The first line records the run options the entries depend on. Each XML file
+    parsed and each media file placed is then appended as one JSON line and
+    flushed, so a run that is killed loses at most the line being written. When a
+    run is resumed, the entries of the journal left behind are loaded if it was
+    written with the same options, and the journal is started over with them.
+
+    Entries only say what was done; whether the files still match them is up to
+    the caller to check, see media_extraction._check_journal_file.
+
+    Args:
+        output_folder (str): Output folder of the run
+        options (dict): JSON-serializable run options the entries depend on
+        resume (bool, optional): Load the entries of an existing journal
+    """
+
+    def __init__(self, output_folder, options, resume=False):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, JOURNAL_FILENAME)
+        self.options = dict(options, version=JOURNAL_VERSION)
+        # Journalled entries by XML file name and by media path relative to the output folder
+        self.xml_files = {}
+        self.media_files = {}
+        # Whether entries were loaded from an earlier run, and how many media files were reused
+        self.resumed = False
+        self.media_reused = 0
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+        self._rewrite()
+
+    def _load(self):
+        """Load the entries of an existing journal written with the same options."""
+        try:
+            with open(self.path, 'r') as f:
+                lines = iter(f)
+                header = json.loads(next(lines, 'null'))
+                if not isinstance(header, dict) or header.get('options') != self.options:
+                    return
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short when the run was killed ends the journal
+                        break
+                    if entry.get('kind') == 'xml':
+                        self.xml_files[entry['file']] = entry
+                    elif entry.get('kind') == 'media':
+                        self.media_files[entry['dest']] = entry
+        except (OSError, ValueError):
+            return
+        self.resumed = True
+
+    def _rewrite(self):
+        """Start the journal over with the header and any loaded entries, then keep it open for appending."""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps({'kind': 'run', 'options': self.options}) + '\n')
+            for entry in list(self.xml_files.values()) + list(self.media_files.values()):
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'a')
+
+    def _append(self, entry):
+        """Append one entry and flush it; safe to call from several threads."""
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def record_xml(self, xml_file, size, sha256, media):
+        """Journal the media found in an XML file with the size and SHA-256 of its content."""
+        self._append({'kind': 'xml', 'file': xml_file, 'size': size, 'sha256': sha256, 'media': media})
+
+    def media_entry(self, dest_path):
+        """Return the journal entry of a media file placed at dest_path, or None."""
+        return self.media_files.get(os.path.relpath(dest_path, self.output_folder))
+
+    def record_media(self, dest_path, size, bytes_written):
+        """Journal a media file placed at dest_path, with its size and the bytes written for it."""
+        self._append({'kind': 'media', 'dest': os.path.relpath(dest_path, self.output_folder),
+                      'size': size, 'bytes': bytes_written})
+
+    def count_reused_media(self):
+        """Count one media file that a resumed run did not have to place again."""
+        with self._lock:
+            self.media_reused += 1
+
+    def close(self):
+        """Close the journal file, keeping it for a later resume."""
+        if not self._file.closed:
+            self._file.close()
+
+    def remove(self):
+        """Close and delete the journal once the run has completed."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,360 @@
+import os
+import csv
+import json
+from itertools import groupby
+
+# heapq, pickle, shutil and tempfile are only needed once references spill to disk,
+# so they are imported there
+
+# Number of references held in memory before a sorted run is spilled to disk
+DEFAULT_RUN_SIZE = 100000
+
+# Number of records pickled together when writing a run file
+RUN_CHUNK_SIZE = 1024
+
+# Column names shared by every export format, in output order
+EXPORT_COLUMNS = ['media_type', 'source', 'title', 'xml_file', 'page_id', 'page_title']
+
+# Extra column holding the content hash of each media file, when media is hashed
+HASH_COLUMN = 'sha256'
+
+def _write_run(records, folder):
+    """Pickle already sorted records to a new run file in chunks and return its path."""
+    import pickle
+    import tempfile
+    fd, path = tempfile.mkstemp(suffix='.run', dir=folder)
+    with os.fdopen(fd, 'wb') as f:
+        for start in range(0, len(records), RUN_CHUNK_SIZE):
+            pickle.dump(records[start:start + RUN_CHUNK_SIZE], f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+def _read_run(path):
+    """Yield the records of a run file written by _write_run."""
+    import pickle
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield from chunk
+
+class ExternalSorter:
+    """
+    Deduplicate media references by source and sort them by page title with bounded memory.
+
+    References are added as they come out of parsing. As with the media_references
+    dict, the last reference added for a source wins, but the source keeps the
+    position of its first occurrence among references with the same page title.
+    Up to run_size references are kept in memory; beyond that, sorted runs are
+    spilled to temporary files and combined with an external merge sort.
+
+    Args:
+        sort_key (callable): Maps a page title to its sort key
+        run_size (int, optional): Maximum number of references held in memory
+        temp_folder (str, optional): Where to create the temporary run files
+    """
+
+    def __init__(self, sort_key, run_size=DEFAULT_RUN_SIZE, temp_folder=None):
+        self.sort_key = sort_key
+        self.run_size = run_size
+        self.temp_folder = temp_folder
+        self._buffer = []
+        self._runs = []
+        self._work_folder = None
+        self._sorted = None
+        self._sorted_path = None
+        self._sequence = 0
+
+    def _spill(self, records, key):
+        """Sort records and write them to a new run file."""
+        if self._work_folder is None:
+            import tempfile
+            self._work_folder = tempfile.mkdtemp(prefix='.media_sort_', dir=self.temp_folder)
+        records.sort(key=key)
+        return _write_run(records, self._work_folder)
+
+    def add(self, src, reference):
+        """Add one media reference."""
+        self._buffer.append((src, self._sequence, reference))
+        self._sequence += 1
+        if len(self._buffer) >= self.run_size:
+            self._runs.append(self._spill(self._buffer, key=lambda record: (record[0], record[1])))
+            self._buffer = []
+
+    def _title_key(self, keys, page_title):
+        """Return the sort key of a page title, computing it once per title."""
+        key = keys.get(page_title)
+        if key is None:
+            key = keys[page_title] = self.sort_key(page_title)
+        return key
+
+    def finish(self):
+        """Stop accepting references and sort what was added."""
+        keys = {}
+
+        if not self._runs:
+            # Everything fits in memory: dedupe with a dict and sort in place
+            unique = {}
+            for src, sequence, reference in self._buffer:
+                if src in unique:
+                    unique[src][3] = reference
+                else:
+                    unique[src] = [None, sequence, src, reference]
+            self._buffer = []
+            records = list(unique.values())
+            for record in records:
+                record[0] = self._title_key(keys, record[3][4])
+            records.sort(key=lambda record: (record[0], record[1]))
+            self._sorted = [(src, reference) for _, _, src, reference in records]
+            return
+
+        # Merge the runs by source to find each source's first position and last reference
+        import heapq
+        import pickle
+        import tempfile
+        self._runs.append(self._spill(self._buffer, key=lambda record: (record[0], record[1])))
+        self._buffer = []
+        merged = heapq.merge(*(_read_run(path) for path in self._runs),
+                             key=lambda record: (record[0], record[1]))
+        by_page_runs = []
+        pending = []
+        for src, group in groupby(merged, key=lambda record: record[0]):
+            first = last = next(group)
+            for last in group:
+                pass
+            reference = last[2]
+            pending.append((self._title_key(keys, reference[4]), first[1], src, reference))
+            if len(pending) >= self.run_size:
+                by_page_runs.append(self._spill(pending, key=lambda record: record[:2]))
+                pending = []
+        if pending:
+            by_page_runs.append(self._spill(pending, key=lambda record: record[:2]))
+        for path in self._runs:
+            os.remove(path)
+        self._runs = []
+
+        # Merge by page title into a single sorted file that can be read repeatedly
+        merged = heapq.merge(*(_read_run(path) for path in by_page_runs), key=lambda record: record[:2])
+        chunk = []
+        fd, self._sorted_path = tempfile.mkstemp(suffix='.sorted', dir=self._work_folder)
+        with os.fdopen(fd, 'wb') as f:
+            for _, _, src, reference in merged:
+                chunk.append((src, reference))
+                if len(chunk) >= RUN_CHUNK_SIZE:
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+        for path in by_page_runs:
+            os.remove(path)
+
+    def __iter__(self):
+        """Iterate over the sorted (src, reference) pairs; may be repeated."""
+        if self._sorted is not None:
+            return iter(self._sorted)
+        return _read_run(self._sorted_path)
+
+    def close(self):
+        """Delete any temporary files."""
+        if self._work_folder is not None:
+            import shutil
+            shutil.rmtree(self._work_folder, ignore_errors=True)
+            self._work_folder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Exporter:
+    """
+    Base class for media reference exporters.
+
+    Subclasses set a file extension and a label for the report, and implement
+    write() for one reference at a time so nothing has to be held in memory.
+    Columns after EXPORT_COLUMNS, such as HASH_COLUMN, are filled from the extra
+    values passed to write(). Optional packages the format needs are listed in
+    requires, so missing ones are reported before an extraction starts.
+    """
+
+    extension = None
+    label = None
+    requires = ()
+
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+
+    def _row(self, src, reference, extra):
+        """Return the values of one row, in column order."""
+        media_type, title, xml_file, page_id, page_title = reference
+        return [media_type, src, title, xml_file, page_id, page_title] + list(extra)
+
+    def write(self, src, reference, *extra):
+        """Write one (src, reference) pair, followed by the values of any extra columns."""
+        raise NotImplementedError
+
+    def close(self):
+        """Finish the export and close the output file."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CsvExporter(Exporter):
+    """Exports references as CSV, quoting fields with the csv module."""
+
+    extension = 'csv'
+    label = 'CSV'
+
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        super().__init__(path, columns)
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(self.columns)
+
+    def write(self, src, reference, *extra):
+        row = self._row(src, reference, extra)
+        # Missing page IDs have always been written as None
+        row[4] = str(row[4])
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+class JsonLinesExporter(Exporter):
+    """Exports references as JSON Lines, one object per reference."""
+
+    extension = 'jsonl'
+    label = 'JSON Lines'
+
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        super().__init__(path, columns)
+        self._file = open(path, 'w')
+
+    def write(self, src, reference, *extra):
+        values = self._row(src, reference, extra)
+        self._file.write(json.dumps(dict(zip(self.columns, values))) + '\n')
+
+    def close(self):
+        self._file.close()
+
+class ParquetExporter(Exporter):
+    """
+    Exports references as a Parquet file, a columnar binary format.
+
+    Rows are buffered and written one row group at a time. Needs pyarrow.
+    """
+
+    extension = 'parquet'
+    label = 'Parquet'
+    requires = ('pyarrow',)
+
+    # Number of references written per row group
+    row_group_size = 65536
+
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        super().__init__(path, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("The parquet export format requires pyarrow (pip install pyarrow)")
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([(column, pyarrow.string()) for column in self.columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self._columns = [[] for _ in self.columns]
+
+    def _flush(self):
+        """Write the buffered rows as one row group."""
+        if self._columns[0]:
+            table = self._pyarrow.Table.from_arrays(self._columns, schema=self._schema)
+            self._writer.write_table(table)
+            self._columns = [[] for _ in self.columns]
+
+    def write(self, src, reference, *extra):
+        for column, value in zip(self._columns, self._row(src, reference, extra)):
+            column.append(value)
+        if len(self._columns[0]) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+# Available export formats, by the name used on the command line
+EXPORTERS = {
+    'csv': CsvExporter,
+    'jsonl': JsonLinesExporter,
+    'parquet': ParquetExporter,
+}
+
+def register_exporter(name, exporter_class):
+    """
+    Make an additional export format available.
+
+    Args:
+        name (str): Format name, as used with --export-format
+        exporter_class (type): Exporter subclass
+    """
+    EXPORTERS[name] = exporter_class
+
+def export_path(output_folder, export_format):
+    """Return the path a format is exported to in the output folder."""
+    return os.path.join(output_folder, f"media_references.{EXPORTERS[export_format].extension}")
+
+def _missing_requirements(export_format):
+    """Return the packages needed by an export format that are not installed."""
+    import importlib.util
+    return [module for module in EXPORTERS[export_format].requires if importlib.util.find_spec(module) is None]
+
+def available_export_formats():
+    """Return the names of the export formats whose required packages are installed."""
+    return [name for name in EXPORTERS if not _missing_requirements(name)]
+
+def check_export_formats(export_formats):
+    """
+    Check that the export formats exist and their required packages are installed.
+
+    Called before an extraction starts, so a missing package doesn't fail the
+    run after all XML files have been parsed.
+
+    Raises:
+        ValueError: For an unknown format
+        ImportError: For a format whose required packages are missing
+    """
+    unknown = [name for name in export_formats if name not in EXPORTERS]
+    if unknown:
+        raise ValueError(f"Unknown export format: {', '.join(unknown)}")
+    for name in export_formats:
+        missing = _missing_requirements(name)
+        if missing:
+            raise ImportError(f"The {name} export format requires {', '.join(missing)} "
+                              f"(pip install {' '.join(missing)})")
+
+def open_exporters(output_folder, export_formats, columns=EXPORT_COLUMNS):
+    """
+    Open one exporter per requested format in the output folder.
+
+    Args:
+        output_folder (str): Folder to write the exports to
+        export_formats (list): Format names from EXPORTERS
+        columns (list, optional): Column names, EXPORT_COLUMNS followed by any extra columns
+
+    Returns:
+        list: Open exporters, in the order of export_formats
+    """
+    check_export_formats(export_formats)
+    exporters = []
+    try:
+        for name in export_formats:
+            exporters.append(EXPORTERS[name](export_path(output_folder, name), columns))
+    except Exception:
+        for exporter in exporters:
+            exporter.close()
+        raise
+    return exporters
@@ -1,10 +1,27 @@
 import os
-import xml.etree.ElementTree as ET
+import io
+import sys
 import argparse
-import shutil
 import re
-from pathlib import Path
-from collections import defaultdict
+import json
+import threading
+import time
+import functools
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
+
+# asyncio, concurrent.futures, hashlib, zipfile, shutil, gzip and mmap are imported where
+# they are used, so importing this module and starting a plain folder extraction stay fast
+
+from media_checkpoint import CheckpointJournal
+from media_export import EXPORT_COLUMNS, EXPORTERS, HASH_COLUMN, ExternalSorter, check_export_formats, open_exporters
+from media_parsers import PARSERS, iter_elements, lxml_available, resolve_parser
+from media_rules import DEFAULT_RULES, MediaRule, compile_rules, load_rules, parse_rule
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; reflinks fall back to copying there
+    fcntl = None
 
 def is_numeric_page_title(page_title):
     """Check if the page title is numeric or starts with a number."""
@@ -22,234 +39,2279 @@ def get_numeric_value(page_title):
     
     return float('inf')  # Non-numeric titles go at the end
 
+# One media reference. A namedtuple has no per-instance __dict__ (its __slots__
+# is empty), so each record is as compact as a plain tuple and still unpacks
+# like the 5-tuples media_references has always held.
+MediaReference = namedtuple('MediaReference', ['media_type', 'title', 'xml_file', 'page_id', 'page_title'])
+
+def page_title_sort_key(page_title):
+    """Return the key media references are sorted by for a page title."""
+    return (
+        # Sort by whether the title is numeric first (numeric comes first)
+        not is_numeric_page_title(page_title),
+        # Then sort by the numeric value if applicable
+        get_numeric_value(page_title),
+        # Finally sort by the full page title string
+        page_title
+    )
+
 def sort_media_references(media_references):
     """
     Sort media references by page_title:
     1. Numeric page titles first (100, 200, etc.)
     2. Text-based page titles at the end
     
+    References with the same page title keep their original order.
+    
     Args:
         media_references (dict): Media references dictionary
         
     Returns:
         dict: Sorted media references dictionary
     """
-    # Create a list of (key, value) pairs from the dictionary
-    items = list(media_references.items())
+    # Group references by page title, so the sort key is computed once per title
+    # and only the distinct titles need sorting
+    by_page_title = {}
+    for src, reference in media_references.items():
+        by_page_title.setdefault(reference[4], []).append((src, reference))
     
-    # Sort the list based on page title
-    sorted_items = sorted(items, key=lambda x: (
-        # Sort by whether the title is numeric first (numeric comes first)
-        not is_numeric_page_title(x[1][4]),
-        # Then sort by the numeric value if applicable
-        get_numeric_value(x[1][4]),
-        # Finally sort by the full page title string
-        x[1][4]
-    ))
+    sorted_items = []
+    for page_title in sorted(by_page_title, key=page_title_sort_key):
+        sorted_items.extend(by_page_title[page_title])
     
     # Convert back to dictionary while preserving order
     return dict(sorted_items)
 
-def extract_media_from_xml(xml_folder, output_folder, book_xml_path=None, media_folder=None):
+# Rules used when none are given, compiled once
+DEFAULT_COMPILED_RULES = compile_rules(DEFAULT_RULES)
+
+# Elements the parser has to return for the page ID and title, besides the rule tags
+PAGE_TAGS = frozenset(['page_node'])
+
+def load_page_titles(book_xml_path, parser='etree'):
     """
-    Extract all media files referenced in XML files and organize them in the output folder.
+    Build the page ID to page title mapping from a book XML in a single streaming pass.
+
+    Only page_node elements below the root element are considered, matching
+    a findall('.//page_node') lookup on the parsed tree.
+
+    Args:
+        book_xml_path (str or file): Path or binary file object of the book XML
+        parser (str, optional): Parser backend, see media_parsers.iter_elements
+
+    Returns:
+        dict: Page IDs mapped to page titles
+    """
+    page_id_to_title = {}
+    for depth, tag, attrib in iter_elements(book_xml_path, PAGE_TAGS, parser):
+        if depth > 0 and 'id' in attrib and 'title' in attrib:
+            page_id_to_title[attrib['id']] = attrib['title']
+    return page_id_to_title
+
+def collect_file_media(xml_path, page_id_to_title=None, rules=None, parser='etree'):
+    """
+    Collect all media referenced in a single page XML file in one streaming pass.
+
+    The page ID and title are resolved from the first page_node child of the root,
+    or from the root itself when it is a page_node with an ID. A matching entry in
+    page_id_to_title overrides the title found in the file.
+
+    Args:
+        xml_path (str or file): Path or binary file object of the page XML
+        page_id_to_title (dict, optional): Page titles loaded from the book XML
+        rules (CompiledRules, optional): Media rules from media_rules.compile_rules;
+            the image, video and audio defaults when not given
+        parser (str, optional): Parser backend, see media_parsers.iter_elements
+
+    Returns:
+        list: (media_type, src, title, page_id, page_title) tuples, grouped by
+        media type in rule order and in document order within a type
+    """
+    if rules is None:
+        rules = DEFAULT_COMPILED_RULES
+    dispatch = rules.dispatch
     
+    # Media found so far, bucketed per type to keep the report order stable
+    found = {media_type: [] for media_type in rules.media_types}
+    root_tag = None
+    root_attrib = {}
+    page_attrib = None
+
+    # Only the root, page_node and rule elements are handed back by the parser
+    tags = PAGE_TAGS | dispatch.keys()
+    for depth, tag, attrib in iter_elements(xml_path, tags, parser):
+        if depth == 0:
+            root_tag = tag
+            root_attrib = attrib
+            continue
+
+        # Remember the first page_node directly below the root
+        if depth == 1 and page_attrib is None and tag == 'page_node':
+            page_attrib = attrib
+
+        # One lookup per element, however many rules there are
+        for src_attr, title_attr, media_type in dispatch.get(tag, ()):
+            if src_attr in attrib:
+                title = attrib.get(title_attr, 'No Title') if title_attr else 'No Title'
+                found[media_type].append((attrib[src_attr], title))
+
+    # Get the page_node id in different ways
+    page_id = None
+    page_title = "Unknown Page"
+
+    # Check if root has a page_node child
+    if page_attrib is not None:
+        if 'id' in page_attrib:
+            page_id = page_attrib['id']
+        if 'title' in page_attrib:
+            page_title = page_attrib['title']
+    # Or if the root itself is a page_node
+    elif root_tag == 'page_node' and 'id' in root_attrib:
+        page_id = root_attrib['id']
+        if 'title' in root_attrib:
+            page_title = root_attrib['title']
+
+    # If a book XML was provided, use its title mapping if available
+    if page_id and page_id_to_title and page_id in page_id_to_title:
+        page_title = page_id_to_title[page_id]
+
+    file_media = []
+    for media_type, entries in found.items():
+        for src, title in entries:
+            file_media.append((media_type, src, title, page_id, page_title))
+    return file_media
+
+def _stage_clock():
+    """Return the current (wall, CPU) clock readings used to time a stage."""
+    return time.perf_counter(), time.process_time()
+
+def _record_stage(metrics, name, started, items):
+    """
+    Record the wall time, CPU time and item count of a finished stage.
+
     Args:
-        xml_folder (str): Path to the folder containing XML files
-        output_folder (str): Path to save extracted media references
-        media_folder (str, optional): Path to the folder containing actual media files
+        metrics (dict or None): Metrics being collected; nothing is recorded when None
+        name (str): Stage name
+        started (tuple): Clock readings from _stage_clock when the stage started
+        items (int): Number of items the stage handled
+    """
+    if metrics is None:
+        return
+    wall_started, cpu_started = started
+    metrics['stages'][name] = {
+        'wall_seconds': time.perf_counter() - wall_started,
+        'cpu_seconds': time.process_time() - cpu_started,
+        'items': items,
+    }
+
+def is_zip_source(source):
+    """Check whether an XML or media source is a ZIP archive (a path or a file-like object)."""
+    if hasattr(source, 'read'):
+        return True
+    if not isinstance(source, (str, os.PathLike)) or not os.path.isfile(source):
+        return False
+    import zipfile
+    return zipfile.is_zipfile(source)
+
+def _is_archive_member_wanted(info, extensions=None):
+    """Skip folders, macOS resource forks and hidden entries when reading an archive."""
+    name = info.filename
+    if extensions and not name.lower().endswith(extensions):
+        return False
+    return not info.is_dir() and not name.startswith('__MACOSX/') and not name.startswith('.')
+
+# Open archives keyed by their source (path or file object), see open_archive
+_open_archives = {}
+
+def open_archive(source):
+    """
+    Open a ZIP source for reading, reusing an already open handle for the same source.
+
+    Worker processes open archives passed by path through here as well and keep
+    them open while they parse files from them.
+    """
+    import zipfile
+    if source not in _open_archives:
+        _open_archives[source] = zipfile.ZipFile(source)
+    return _open_archives[source]
+
+def close_archive(source):
+    """Close an archive opened with open_archive, if it is open."""
+    archive = _open_archives.pop(source, None)
+    if archive is not None:
+        archive.close()
+
+@contextmanager
+def _closing_archives(*sources):
+    """Close any archives opened from sources when the block exits."""
+    try:
+        yield
+    finally:
+        for source in sources:
+            if source is not None and is_zip_source(source):
+                close_archive(source)
+
+def list_xml_inputs(xml_source):
+    """
+    List the XML files to process.
+
+    For a folder each input is the path of an XML file. For a ZIP archive each input
+    is a (source, member name) pair that is read straight from the archive; members
+    in subfolders are listed under their base name, with a _1, _2, ... suffix added
+    when two members share a name.
+
+    Args:
+        xml_source (str or file): Folder containing XML files, or a ZIP archive
+
+    Returns:
+        list: (xml_file, xml_input) pairs
+    """
+    if not is_zip_source(xml_source):
+        return [(f, os.path.join(xml_source, f)) for f in os.listdir(xml_source) if f.endswith('.xml')]
+
+    xml_inputs = {}
+    for info in open_archive(xml_source).infolist():
+        if not _is_archive_member_wanted(info, ('.xml',)):
+            continue
+        base, ext = os.path.splitext(os.path.basename(info.filename))
+        xml_file = base + ext
+        counter = 1
+        while xml_file in xml_inputs:
+            xml_file = f"{base}_{counter}{ext}"
+            counter += 1
+        xml_inputs[xml_file] = (xml_source, info.filename)
+    return list(xml_inputs.items())
+
+# Page titles, media rules and parser backend shared with worker processes, set once per worker by _init_parse_worker
+_worker_page_id_to_title = None
+_worker_rules = None
+_worker_parser = 'etree'
+
+def _init_parse_worker(page_id_to_title, rules=None, parser='etree'):
+    """Store the book page titles, media rules and parser in a worker process so they are sent only once."""
+    global _worker_page_id_to_title, _worker_rules, _worker_parser
+    _worker_page_id_to_title = page_id_to_title
+    _worker_rules = rules
+    _worker_parser = parser
+    # Archive handles inherited from a forked parent share its file offset,
+    # so every worker reopens the archives it needs
+    _open_archives.clear()
+
+def _open_xml_input(xml_input):
+    """Open an XML input from list_xml_inputs, or XML content already read into memory."""
+    if isinstance(xml_input, bytes):
+        return io.BytesIO(xml_input)
+    if isinstance(xml_input, tuple):
+        source, member = xml_input
+        return open_archive(source).open(member)
+    return open(xml_input, 'rb')
+
+class _HashingReader:
+    """
+    Binary file wrapper that computes the size and SHA-256 of the content as it is read.
+
+    The checkpoint journal records both for every parsed file, so the file is
+    hashed while the parser reads it instead of being read a second time.
+    """
+
+    def __init__(self, stream):
+        import hashlib
+        self._sha256 = hashlib.sha256
+        self._stream = stream
+        self._digest = self._sha256()
+        self._size = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._digest.update(data)
+        self._size += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        # Only rewinding is needed, when a parser backend falls back to ElementTree
+        if offset or whence:
+            raise io.UnsupportedOperation("can only rewind")
+        self._stream.seek(0)
+        self._digest = self._sha256()
+        self._size = 0
+        return 0
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    def checksum(self):
+        """Finish reading the content and return its (size, sha256)."""
+        if not self._size:
+            # The scan parser memory-maps files instead of reading them, and the
+            # mapped pages are hashed while they are still in the page cache
+            import mmap
+            try:
+                with mmap.mmap(self._stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return len(mapped), self._sha256(mapped).hexdigest()
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                pass
+        while self.read(1024 * 1024):
+            pass
+        return self._size, self._digest.hexdigest()
+
+def _parse_xml_file(xml_input, page_id_to_title, rules=None, parser='etree'):
+    """
+    Parse one XML file, capturing any error instead of raising it.
+
+    Returns:
+        tuple: (file_media, error, timing, checksum) where error is the error message
+        or None, timing is a (wall_seconds, cpu_seconds) pair for parsing the file and
+        checksum the (size, sha256) of its content, or None when it could not be parsed
+    """
+    started = _stage_clock()
+    checksum = None
+    try:
+        with _open_xml_input(xml_input) as xml_stream:
+            reader = _HashingReader(xml_stream)
+            file_media, error = collect_file_media(reader, page_id_to_title, rules, parser), None
+            checksum = reader.checksum()
+    except Exception as e:
+        file_media, error = None, str(e)
+    wall_started, cpu_started = started
+    return file_media, error, (time.perf_counter() - wall_started, time.process_time() - cpu_started), checksum
+
+def _parse_xml_file_task(xml_input):
+    """Parse one XML file inside a worker process."""
+    return _parse_xml_file(xml_input, _worker_page_id_to_title, _worker_rules, _worker_parser)
+
+def _parse_xml_file_for_book(xml_input, book_key, rules, parser='etree'):
+    """
+    Parse one XML file in a worker process of a pool shared by several books.
+
+    The page titles are looked up with load_page_index, so each worker loads
+    them once per book from the page index and keeps them in its LRU cache.
+    Books are extracted one after another, so an archive of an earlier book is
+    closed as soon as a file of another one arrives.
+    """
+    source = xml_input[0] if isinstance(xml_input, tuple) else None
+    for open_source in list(_open_archives):
+        if open_source != source:
+            close_archive(open_source)
+    page_id_to_title = None
+    if book_key is not None:
+        book_xml_path, sha256, index_folder = book_key
+        page_id_to_title = load_page_index(book_xml_path, index_folder, sha256, parser)[0]
+    return _parse_xml_file(xml_input, page_id_to_title, rules, parser)
+
+def _read_xml_input(xml_input):
+    """Read the whole content of an XML input from list_xml_inputs."""
+    with _open_xml_input(xml_input) as xml_stream:
+        return xml_stream.read()
+
+def parse_xml_files(xml_inputs, page_id_to_title=None, workers=1, rules=None, executor=None, book_key=None,
+                    parser='etree'):
     """
+    Parse XML files and yield their media in the order of xml_inputs.
+
+    With more than one worker the files are parsed in a process pool, but results
+    are still yielded in input order so the report and CSV stay deterministic.
+    Archives given as file objects rather than paths are always parsed in-process.
+
+    Args:
+        xml_inputs (list): (xml_file, xml_input) pairs from list_xml_inputs
+        page_id_to_title (dict, optional): Page titles loaded from the book XML
+        workers (int, optional): Number of worker processes (1 parses in-process)
+        rules (CompiledRules, optional): Media rules, see collect_file_media
+        executor (ProcessPoolExecutor, optional): Worker pool shared by several books,
+            started with _init_parse_worker, used instead of a pool of its own
+        book_key (tuple, optional): (book XML path, content hash, page index folder)
+            from which workers of a shared pool load the page titles
+        parser (str, optional): Parser backend, see media_parsers.iter_elements
+
+    Yields:
+        tuple: (xml_file, file_media, error, timing, checksum) where error is the error message
+        or None, timing is a (wall_seconds, cpu_seconds) pair measured where the file was parsed
+        and checksum the (size, sha256) of the file content, see _parse_xml_file
+    """
+    task_inputs = [xml_input for _, xml_input in xml_inputs]
+    in_memory = any(isinstance(xml_input, tuple) and hasattr(xml_input[0], 'read')
+                    for xml_input in task_inputs)
+
+    if (executor is None and workers <= 1) or len(xml_inputs) <= 1 or in_memory:
+        for xml_file, xml_input in xml_inputs:
+            yield (xml_file,) + _parse_xml_file(xml_input, page_id_to_title, rules, parser)
+        return
+
+    # Hand out files in chunks to keep inter-process overhead low
+    chunksize = max(1, min(64, len(task_inputs) // (workers * 4)))
+    if executor is not None:
+        count = len(task_inputs)
+        results = executor.map(_parse_xml_file_for_book, task_inputs, [book_key] * count, [rules] * count,
+                               [parser] * count, chunksize=chunksize)
+        for (xml_file, _), result in zip(xml_inputs, results):
+            yield (xml_file,) + result
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker,
+                             initargs=(page_id_to_title, rules, parser)) as executor:
+        results = executor.map(_parse_xml_file_task, task_inputs, chunksize=chunksize)
+        for (xml_file, _), result in zip(xml_inputs, results):
+            yield (xml_file,) + result
+
+# Name of the results file written by cross_check_parsers in the output folder
+CROSS_CHECK_FILENAME = "media_parser_cross_check.json"
+
+def _parse_with_backend(xml_input, tags, parser):
+    """
+    Parse an XML input with one backend, without falling back to ElementTree.
+
+    Returns:
+        tuple: (result, seconds) where result is the list of (depth, tag, attrib)
+        elements found, or the exception raised
+    """
+    started = time.perf_counter()
+    try:
+        with _open_xml_input(xml_input) as xml_stream:
+            result = list(iter_elements(xml_stream, tags, parser, fallback=False))
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - started
+
+def _first_difference(expected, found):
+    """Describe where the elements found by a backend first differ from those of ElementTree."""
+    for index, (expected_element, found_element) in enumerate(zip(expected, found)):
+        if expected_element != found_element:
+            return f"element {index}: expected {expected_element!r}, found {found_element!r}"
+    return f"expected {len(expected)} elements, found {len(found)}"
+
+def cross_check_parsers(xml_folder, output_folder, book_xml_path=None, rules=None, parsers=None):
+    """
+    Parse the same XML files with each parser backend and compare the results with ElementTree.
+
+    For every file, and the book XML if given, the root, page_node and rule elements
+    (tags and attributes, in document order) found by each backend must equal those
+    found by ElementTree. Backends run without their fallback: a file a backend
+    raises on counts as a fallback, since a real run would parse it with ElementTree,
+    but a file it parses differently, or parses where ElementTree fails, is a
+    mismatch. The results are printed and saved to media_parser_cross_check.json
+    in the output folder.
+
+    Args:
+        xml_folder (str or file): Folder containing XML files, or a ZIP archive
+        output_folder (str): Folder to save the results in
+        book_xml_path (str, optional): Path to the book XML file
+        rules (list, optional): Media rules whose tags are compared, see extract_media_from_xml
+        parsers (list, optional): Backends to compare with ElementTree; lxml (when
+            installed) and scan when not given
+
+    Returns:
+        dict: Per-backend counts of matched files, fallbacks and mismatches, and parse times
+    """
+    if parsers is None:
+        parsers = ['lxml', 'scan'] if lxml_available() else ['scan']
+    tags = PAGE_TAGS | compile_rules(rules).dispatch.keys()
+    os.makedirs(output_folder, exist_ok=True)
+
+    results = {
+        'files': 0,
+        'etree_seconds': 0.0,
+        'parsers': {parser: {'matched': 0, 'fallbacks': 0, 'mismatches': [], 'seconds': 0.0}
+                    for parser in parsers},
+    }
+    with _closing_archives(xml_folder):
+        inputs = [(xml_file, xml_input, tags) for xml_file, xml_input in list_xml_inputs(xml_folder)]
+        if book_xml_path:
+            inputs.insert(0, (os.path.basename(book_xml_path), book_xml_path, PAGE_TAGS))
+
+        for xml_file, xml_input, file_tags in inputs:
+            expected, seconds = _parse_with_backend(xml_input, file_tags, 'etree')
+            results['files'] += 1
+            results['etree_seconds'] += seconds
+            for parser in parsers:
+                found, seconds = _parse_with_backend(xml_input, file_tags, parser)
+                counts = results['parsers'][parser]
+                counts['seconds'] += seconds
+                if isinstance(found, Exception):
+                    counts['fallbacks'] += 1
+                elif isinstance(expected, Exception):
+                    counts['mismatches'].append({'xml_file': xml_file,
+                                                 'difference': f"ElementTree failed: {str(expected)}"})
+                elif found != expected:
+                    counts['mismatches'].append({'xml_file': xml_file,
+                                                 'difference': _first_difference(expected, found)})
+                else:
+                    counts['matched'] += 1
+
+    print(f"Cross-checked {results['files']} XML files against etree ({results['etree_seconds']:.3f}s)")
+    for parser, counts in results['parsers'].items():
+        print(f"{parser}: {counts['matched']} matched, {counts['fallbacks']} left to etree, "
+              f"{len(counts['mismatches'])} mismatches ({counts['seconds']:.3f}s)")
+        for mismatch in counts['mismatches']:
+            print(f"  - {mismatch['xml_file']}: {mismatch['difference']}")
+
+    results_path = os.path.join(output_folder, CROSS_CHECK_FILENAME)
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Cross-check results saved to {results_path}")
+    return results
+
+# Name of the incremental re-extraction manifest kept in the output folder
+MANIFEST_FILENAME = "media_extraction_manifest.json"
+MANIFEST_VERSION = 1
+
+def _file_digest(xml_input, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file or archive member, read in chunks."""
+    import hashlib
+    digest = hashlib.sha256()
+    with _open_xml_input(xml_input) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _file_signature(xml_input):
+    """Return the size and modification time recorded for a file or archive member in the manifest."""
+    if isinstance(xml_input, tuple):
+        source, member = xml_input
+        info = open_archive(source).getinfo(member)
+        return {'size': info.file_size, 'mtime': list(info.date_time)}
+    stat = os.stat(xml_input)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def _manifest_entry_is_current(entry, path, signature):
+    """
+    Check whether a manifest entry still describes the file at path.
+
+    Size and mtime are compared first; when they differ the content hash decides,
+    so a file that was only touched is still reused. The entry's signature is
+    refreshed in that case.
+    """
+    if not entry or entry.get('size') != signature['size']:
+        return False
+    if entry.get('mtime') == signature['mtime']:
+        return True
+    if entry.get('sha256') == _file_digest(path):
+        entry['mtime'] = signature['mtime']
+        return True
+    return False
+
+def load_manifest(output_folder):
+    """
+    Load the incremental re-extraction manifest from the output folder.
+
+    Args:
+        output_folder (str): Folder holding the manifest
+
+    Returns:
+        dict: The manifest, or an empty one if it is missing, unreadable or outdated
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'book_xml': None, 'files': {}}
+
+def save_manifest(output_folder, manifest):
+    """Atomically write the incremental re-extraction manifest to the output folder."""
+    manifest_path = os.path.join(output_folder, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+
+# Version of the on-disk page index format
+PAGE_INDEX_VERSION = 1
+
+# Number of book page maps kept in memory for reuse across calls
+PAGE_INDEX_CACHE_SIZE = 8
+
+# Limits of the on-disk page index; the least recently used books are removed beyond either
+PAGE_INDEX_MAX_FILES = 64
+PAGE_INDEX_MAX_BYTES = 256 * 1024 * 1024
+
+# Page maps by book XML content hash, least recently used first
+_page_index_cache = OrderedDict()
+_page_index_lock = threading.Lock()
+
+def default_page_index_folder():
+    """Return the folder page indexes are stored in when no folder is given."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'media_extraction', 'page_index')
+
+def _page_index_path(index_folder, sha256):
+    """Return the path of the on-disk page index of a book XML."""
+    return os.path.join(index_folder, f"{sha256}.json.gz")
+
+def _read_page_index(index_path, sha256):
+    """Read a page index written by _write_page_index, or return None if it is unusable."""
+    import gzip
+    try:
+        with gzip.open(index_path, 'rt', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == PAGE_INDEX_VERSION and index.get('sha256') == sha256:
+            page_id_to_title = dict(zip(index['ids'], index['titles']))
+            try:
+                # Mark the index as recently used, so pruning keeps it
+                os.utime(index_path)
+            except OSError:
+                pass
+            return page_id_to_title
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def _write_page_index(index_path, sha256, page_id_to_title):
+    """Atomically write a page index as compressed JSON with parallel ID and title lists."""
+    import gzip
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    index = {
+        'version': PAGE_INDEX_VERSION,
+        'sha256': sha256,
+        'ids': list(page_id_to_title),
+        'titles': list(page_id_to_title.values()),
+    }
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temp_path, index_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    _prune_page_indexes(os.path.dirname(index_path), index_path)
+
+def _prune_page_indexes(index_folder, keep_path):
+    """
+    Remove the least recently used page indexes beyond PAGE_INDEX_MAX_FILES or PAGE_INDEX_MAX_BYTES.
+
+    Indexes are ordered by modification time, which _read_page_index updates on
+    every use. keep_path, the index just written, is never removed.
+    """
+    indexes = []
+    with os.scandir(index_folder) as entries:
+        for entry in entries:
+            if entry.name.endswith('.json.gz') and entry.path != keep_path:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                indexes.append((stat.st_mtime, stat.st_size, entry.path))
+    # Newest first; the index just written counts towards both limits
+    indexes.sort(reverse=True)
+    count = 1
+    total_bytes = os.path.getsize(keep_path)
+    for _, size, path in indexes:
+        count += 1
+        total_bytes += size
+        if count > PAGE_INDEX_MAX_FILES or total_bytes > PAGE_INDEX_MAX_BYTES:
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by a concurrent run
+                pass
+
+def _remember_page_index(sha256, page_id_to_title):
+    """Add a page map to the in-process cache, evicting the least recently used one."""
+    with _page_index_lock:
+        _page_index_cache[sha256] = page_id_to_title
+        _page_index_cache.move_to_end(sha256)
+        while len(_page_index_cache) > PAGE_INDEX_CACHE_SIZE:
+            _page_index_cache.popitem(last=False)
+
+def load_page_index(book_xml_path, index_folder=None, sha256=None, parser='etree'):
+    """
+    Load the page ID to title map of a book XML, reusing earlier results where possible.
+
+    Maps are keyed by the SHA-256 of the book XML content, so the same book is
+    recognized under any path, e.g. when it is uploaded again. Lookups go to an
+    in-process LRU cache first, then to a compact on-disk index; only when both
+    miss is the book parsed with load_page_titles, and the result stored in both.
+    A page index folder that cannot be written only disables the on-disk index.
+
+    Args:
+        book_xml_path (str): Path of the book XML
+        index_folder (str or bool, optional): Folder for the on-disk index, by default
+            default_page_index_folder(); False keeps the index in memory only
+        sha256 (str, optional): Content hash of the book XML, if already known
+        parser (str, optional): Parser backend used when the book has to be parsed
+
+    Returns:
+        tuple: (page_id_to_title, source) where source is 'memory', 'disk' or 'parsed'.
+        The returned dict is shared with the cache and must not be modified.
+    """
+    if sha256 is None:
+        sha256 = _file_digest(book_xml_path)
+    
+    with _page_index_lock:
+        page_id_to_title = _page_index_cache.get(sha256)
+        if page_id_to_title is not None:
+            _page_index_cache.move_to_end(sha256)
+            return page_id_to_title, 'memory'
+    
+    if index_folder is None:
+        index_folder = default_page_index_folder()
+    index_path = _page_index_path(index_folder, sha256) if index_folder else None
+    
+    source = 'disk'
+    page_id_to_title = _read_page_index(index_path, sha256) if index_path else None
+    if page_id_to_title is None:
+        source = 'parsed'
+        page_id_to_title = load_page_titles(book_xml_path, parser)
+        if index_path:
+            try:
+                _write_page_index(index_path, sha256, page_id_to_title)
+            except OSError as e:
+                print(f"Could not save the page index: {str(e)}")
+    
+    _remember_page_index(sha256, page_id_to_title)
+    return page_id_to_title, source
+
+# How media files are placed in the type and page trees of the output folder
+LINK_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+# ioctl request number for cloning a file on Linux (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+def _reflink(source_path, dest_path):
+    """Clone source_path to dest_path so both share the same data blocks."""
+    import shutil
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source_path, dest_path)
+
+def place_media_file(source_path, dest_path, link_mode='copy'):
+    """
+    Place a media file in the output folder by copying or linking it.
+
+    Any existing file at dest_path is replaced. Links that cannot be created,
+    for example across filesystems or on filesystems without reflink support,
+    fall back to a regular copy. Archive members are always extracted.
+
+    Args:
+        source_path (str or tuple): Existing file to place, or an (archive source,
+            member name) pair from index_media_folder
+        dest_path (str): Destination path in the output folder
+        link_mode (str, optional): One of LINK_MODES
+
+    Returns:
+        int: Number of bytes actually written
+    """
+    import shutil
+    # Remove old output first so a copy never writes through a previous run's link
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    
+    if isinstance(source_path, tuple):
+        source, member = source_path
+        with open_archive(source).open(member) as src, open(dest_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return os.path.getsize(dest_path)
+
+    if link_mode != 'copy':
+        try:
+            if link_mode == 'hardlink':
+                os.link(source_path, dest_path)
+            elif link_mode == 'symlink':
+                os.symlink(os.path.relpath(source_path, os.path.dirname(dest_path)), dest_path)
+            elif link_mode == 'reflink':
+                _reflink(source_path, dest_path)
+            else:
+                raise ValueError(f"Unknown link mode: {link_mode}")
+            return 0
+        except OSError:
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+
+    shutil.copy2(source_path, dest_path)
+    return os.path.getsize(dest_path)
+
+def _update_progress(progress, **counters):
+    """Update the caller's progress counters, if any were passed in."""
+    if progress is not None:
+        progress.update(counters)
+
+def index_media_folder(media_folder):
+    """
+    List the files in a media folder with a single directory scan.
+
+    For a ZIP archive the members are indexed by base name instead, so nothing is
+    extracted until a referenced file is copied. When several members share a base
+    name the first one wins; members in subfolders are also indexed by their full
+    name, so resolve_media_source can tell them apart.
+
+    Args:
+        media_folder (str or file): Folder containing the actual media files, or a ZIP archive
+
+    Returns:
+        dict: File names mapped to their full paths, or to (archive source, member name) pairs
+    """
+    if is_zip_source(media_folder):
+        media_index = {}
+        for info in open_archive(media_folder).infolist():
+            if _is_archive_member_wanted(info):
+                source_path = (media_folder, info.filename)
+                media_index.setdefault(os.path.basename(info.filename), source_path)
+                media_index.setdefault(info.filename, source_path)
+        return media_index
+    with os.scandir(media_folder) as entries:
+        return {entry.name: entry.path for entry in entries if entry.is_file()}
+
+def _plan_media_copies(media_references, media_index, output_folder, report, link_mode, content_hashes=None):
+    """
+    Work out where each referenced media file is placed, without touching the disk.
+
+    Missing files, basename collisions and duplicates are written to the report in
+    media_references order. When two different files would be stored under the
+    same name in a type folder, the later one gets a _1, _2, ... suffix instead of
+    overwriting the first. With content hashes, a file that is byte-identical to
+    one already stored is not stored again; its page entries use the stored copy.
+
+    Args:
+        media_references (dict or iterable): Sorted media references, as a dict or as
+            (src, reference) pairs
+        media_index (dict): Media files from index_media_folder
+        output_folder (str): Folder to save extraction results
+        report (file): Open report file
+        link_mode (str): One of LINK_MODES, see place_media_file
+        content_hashes (dict, optional): (sha256, size) pairs by media_index entry,
+            from hash_media_files
+
+    Returns:
+        tuple: (type_jobs, page_jobs, folders, copied_count, missing_count, dedup_stats)
+        where the jobs map destination paths to (source_path, link_mode) pairs and
+        dedup_stats counts 'collisions', 'duplicates' and 'duplicate_bytes'
+    """
+    media_output_folder = os.path.join(output_folder, "media")
+    page_based_folder = os.path.join(output_folder, "media_by_page")
+    
+    copied_count = 0
+    missing_count = 0
+    dedup_stats = {'collisions': 0, 'duplicates': 0, 'duplicate_bytes': 0}
+    
+    # Planned placements keyed by destination. A destination is always fed from the
+    # same source file, so repeated references only need to be placed once.
+    type_jobs = {}
+    page_jobs = {}
+    folders = {media_output_folder, page_based_folder}
+    
+    # Source file stored at each type folder destination, and the destination chosen
+    # for each (type folder, source file), so collisions are resolved only once
+    dest_sources = {}
+    stored_paths = {}
+    # First stored destination of each content hash
+    stored_by_hash = {}
+    
+    if isinstance(media_references, dict):
+        media_references = media_references.items()
+    
+    for src, (media_type, title, _, page_id, page_title) in media_references:
+        # Handle potential path differences
+        # Some systems might store just the filename in src, others might have a path
+        src_filename = os.path.basename(src)
+        
+        # Look for the media file in media_folder
+        source_path = resolve_media_source(media_index, src)
+        
+        if source_path is None:
+            report.write(f"Missing media file: {src_filename}\n")
+            missing_count += 1
+            continue
+        
+        content_hash, size = content_hashes.get(source_path, (None, 0)) if content_hashes else (None, 0)
+        
+        # Subdirectory for media type. This holds the stored copy; with symlinks it
+        # must be a real file since the media folder may be temporary.
+        type_folder = os.path.join(media_output_folder, media_type + "s")
+        dest_path = stored_paths.get((type_folder, source_path))
+        if dest_path is None:
+            # A different file already stored under this name is a basename collision,
+            # unless hashing shows both have the same content
+            stem, ext = os.path.splitext(src_filename)
+            dest_path = os.path.join(type_folder, src_filename)
+            counter = 1
+            while dest_path in dest_sources and dest_sources[dest_path] != source_path and (
+                    content_hash is None or content_hashes.get(dest_sources[dest_path], (None,))[0] != content_hash):
+                dest_path = os.path.join(type_folder, f"{stem}_{counter}{ext}")
+                counter += 1
+            if counter > 1:
+                report.write(f"Basename collision: {src} stored as {os.path.basename(dest_path)}\n")
+                dedup_stats['collisions'] += 1
+            stored_paths[(type_folder, source_path)] = dest_path
+            # A different file with the same name and content reuses the stored copy
+            stored_source = dest_sources.setdefault(dest_path, source_path)
+            
+            # Byte-identical to a file stored earlier: link the page entries to that copy
+            stored_path = stored_by_hash.setdefault(content_hash, dest_path) if content_hash else dest_path
+            if stored_path != dest_path or stored_source != source_path:
+                report.write(f"Duplicate media file: {src} is identical to "
+                             f"{os.path.relpath(stored_path, media_output_folder)}\n")
+                dedup_stats['duplicates'] += 1
+                dedup_stats['duplicate_bytes'] += size
+            else:
+                type_link_mode = 'copy' if link_mode == 'symlink' else link_mode
+                type_jobs[dest_path] = (source_path, type_link_mode)
+        stored_path = stored_by_hash.get(content_hash, dest_path) if content_hash else dest_path
+        
+        # Page-based organization, linked to the stored copy. Archive members are
+        # only extracted once, into the type folder, and copied from there.
+        # Format folder name to be safe for filesystem
+        safe_page_title = page_title.replace('/', '-').replace('\\', '-')
+        page_folder = os.path.join(page_based_folder, f"{safe_page_title}")
+        page_dest_path = os.path.join(page_folder, os.path.basename(dest_path))
+        from_source = link_mode == 'copy' and not isinstance(source_path, tuple)
+        page_source_path = source_path if from_source else stored_path
+        page_jobs[page_dest_path] = (page_source_path, link_mode)
+        
+        folders.update((type_folder, page_folder))
+        copied_count += 1
+    
+    return type_jobs, page_jobs, folders, copied_count, missing_count, dedup_stats
+
+def _create_folders(folders):
+    """Create all destination folders, parents first."""
+    for folder in sorted(folders):
+        os.makedirs(folder, exist_ok=True)
+
+def resolve_media_source(media_index, src):
+    """
+    Find the media file a src attribute refers to.
+
+    A src that matches a path in the media index exactly (for example an archive
+    member in a subfolder) is preferred; otherwise the file is looked up by base name.
+
+    Args:
+        media_index (dict): Media files from index_media_folder
+        src (str): Source attribute of a media element
+
+    Returns:
+        str or tuple: Entry of media_index, or None when the file is missing
+    """
+    path = src.replace('\\', '/')
+    while path.startswith('./'):
+        path = path[2:]
+    source_path = media_index.get(path.lstrip('/'))
+    if source_path is None:
+        source_path = media_index.get(os.path.basename(src))
+    return source_path
+
+def hash_media_file(source_path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 and size of a media file.
+
+    Regular files are memory-mapped and hashed in one call, which releases the GIL
+    so several files hash in parallel on a thread pool. Archive members and files
+    that cannot be mapped are read in chunks.
+
+    Args:
+        source_path (str or tuple): File path, or an (archive source, member name) pair
+
+    Returns:
+        tuple: (sha256 hex digest, size in bytes)
+    """
+    import hashlib
+    import mmap
+    digest = hashlib.sha256()
+    if isinstance(source_path, tuple):
+        source, member = source_path
+        stream = open_archive(source).open(member)
+    else:
+        stream = open(source_path, 'rb')
+        try:
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+                size = len(mapped)
+            stream.close()
+            return digest.hexdigest(), size
+        except (OSError, ValueError):
+            # Empty files and special files can't be mapped
+            pass
+    size = 0
+    with stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def hash_media_files(media_references, media_folder, hash_workers=8):
+    """
+    Hash every distinct media file the references resolve to, in parallel.
+
+    Args:
+        media_references (dict or iterable): Media references, as a dict or as
+            (src, reference) pairs
+        media_folder (str or file): Folder containing the actual media files, or a ZIP archive
+        hash_workers (int, optional): Number of files hashed concurrently
+
+    Returns:
+        tuple: (media_index, content_hashes) where content_hashes maps each
+        media_index entry that is referenced to its (sha256, size) pair
+    """
+    media_index = index_media_folder(media_folder)
+    sources = []
+    seen = set()
+    for src in media_references:
+        if isinstance(src, tuple):
+            src = src[0]
+        source_path = resolve_media_source(media_index, src)
+        if source_path is not None and source_path not in seen:
+            seen.add(source_path)
+            sources.append(source_path)
+    
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, hash_workers)) as executor:
+        content_hashes = dict(zip(sources, executor.map(hash_media_file, sources)))
+    return media_index, content_hashes
+
+def _place_media_file_checkpointed(source_path, dest_path, link_mode, journal, content_hashes=None):
+    """
+    Place a media file like place_media_file and journal it, unless a resumed run already did.
+
+    A journalled file is only reused when it still has the journalled size and the
+    same content hash as its source.
+
+    Returns:
+        int: Number of bytes written for the file, including by the interrupted run
+    """
+    entry = journal.media_entry(dest_path)
+    if entry is not None and os.path.isfile(dest_path) and os.path.getsize(dest_path) == entry['size']:
+        source_hash = (content_hashes or {}).get(source_path) or hash_media_file(source_path)
+        if hash_media_file(dest_path)[0] == source_hash[0]:
+            journal.count_reused_media()
+            return entry['bytes']
+    bytes_written = place_media_file(source_path, dest_path, link_mode)
+    journal.record_media(dest_path, os.path.getsize(dest_path), bytes_written)
+    return bytes_written
+
+def copy_media_files(media_references, media_folder, output_folder, report, link_mode='copy',
+                     copy_workers=8, progress=None, content_hashes=None, media_index=None, journal=None):
+    """
+    Copy referenced media files into the type-based and page-based output folders.
+
+    The media folder is indexed once up front, all destination folders are created
+    before copying starts, and the copies run on a bounded thread pool. Missing
+    files are written to the report in media_references order.
+
+    Args:
+        media_references (dict or iterable): Sorted media references, as a dict or as
+            (src, reference) pairs
+        media_folder (str or file): Folder containing the actual media files, or a ZIP archive
+        output_folder (str): Folder to save extraction results
+        report (file): Open report file
+        link_mode (str, optional): One of LINK_MODES, see place_media_file
+        copy_workers (int, optional): Maximum number of concurrent copies
+        progress (dict, optional): Progress counters, see extract_media_from_xml
+        content_hashes (dict, optional): Content hashes from hash_media_files, to store
+            byte-identical media only once
+        media_index (dict, optional): Media index from hash_media_files, so the media
+            folder is not indexed again
+        journal (CheckpointJournal, optional): Journal each placed file in it, and skip
+            files a resumed run already placed
+
+    Returns:
+        tuple: (copied_count, missing_count, bytes_written, dedup_stats), see
+        _plan_media_copies for dedup_stats
+    """
+    if media_index is None:
+        media_index = index_media_folder(media_folder)
+    type_jobs, page_jobs, folders, copied_count, missing_count, dedup_stats = _plan_media_copies(
+        media_references, media_index, output_folder, report, link_mode, content_hashes
+    )
+    _create_folders(folders)
+    place = place_media_file
+    if journal is not None:
+        place = functools.partial(_place_media_file_checkpointed, journal=journal, content_hashes=content_hashes)
+    
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    bytes_written = 0
+    with ThreadPoolExecutor(max_workers=max(1, copy_workers)) as executor:
+        # Stored copies go first since page entries may link to them
+        for jobs in (type_jobs, page_jobs):
+            futures = [
+                executor.submit(place, source_path, dest_path, mode)
+                for dest_path, (source_path, mode) in jobs.items()
+            ]
+            for future in as_completed(futures):
+                bytes_written += future.result()
+                _update_progress(progress, bytes_copied=bytes_written)
+    
+    return copied_count, missing_count, bytes_written, dedup_stats
+
+async def _run_bounded(items, handler, concurrency, queue_size):
+    """
+    Feed items through a bounded queue to a fixed number of handler tasks.
+
+    Putting an item blocks while the queue is full, so a slow stage holds back
+    whatever feeds it instead of letting work pile up in memory. The first error
+    raised by a handler stops the remaining items and is raised once all handler
+    tasks have finished.
+
+    Args:
+        items (iterable): Items to handle
+        handler (coroutine function): Called with each item
+        concurrency (int): Number of handler tasks
+        queue_size (int): Maximum number of items waiting in the queue
+    """
+    import asyncio
+    queue = asyncio.Queue(maxsize=max(1, queue_size))
+    errors = []
+    
+    async def handle_items():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if not errors:
+                try:
+                    await handler(item)
+                except Exception as e:
+                    errors.append(e)
+    
+    tasks = [asyncio.ensure_future(handle_items()) for _ in range(max(1, concurrency))]
+    try:
+        for item in items:
+            if errors:
+                break
+            await queue.put(item)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if errors:
+        raise errors[0]
+
+async def copy_media_files_async(media_references, media_folder, output_folder, report, link_mode='copy',
+                                 copy_workers=8, progress=None, content_hashes=None, media_index=None,
+                                 journal=None):
+    """
+    Asynchronous version of copy_media_files, used by extract_media_async.
+
+    Indexing, planning and every copy run on a pool of copy_workers threads, fed
+    through a bounded queue, so the event loop is never blocked by the disk.
+
+    Args:
+        media_references (dict or iterable): Sorted media references, as a dict or as
+            (src, reference) pairs
+        media_folder (str or file): Folder containing the actual media files, or a ZIP archive
+        output_folder (str): Folder to save extraction results
+        report (file): Open report file
+        link_mode (str, optional): One of LINK_MODES, see place_media_file
+        copy_workers (int, optional): Maximum number of concurrent copies
+        progress (dict, optional): Progress counters, see extract_media_from_xml
+        content_hashes (dict, optional): Content hashes from hash_media_files, to store
+            byte-identical media only once
+        media_index (dict, optional): Media index from hash_media_files, so the media
+            folder is not indexed again
+        journal (CheckpointJournal, optional): Journal each placed file in it, and skip
+            files a resumed run already placed
+
+    Returns:
+        tuple: (copied_count, missing_count, bytes_written, dedup_stats), see
+        _plan_media_copies for dedup_stats
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    loop = asyncio.get_running_loop()
+    bytes_written = 0
+    
+    with ThreadPoolExecutor(max_workers=max(1, copy_workers)) as executor:
+        if media_index is None:
+            media_index = await loop.run_in_executor(executor, index_media_folder, media_folder)
+        type_jobs, page_jobs, folders, copied_count, missing_count, dedup_stats = await loop.run_in_executor(
+            executor, _plan_media_copies, media_references, media_index, output_folder, report, link_mode,
+            content_hashes
+        )
+        await loop.run_in_executor(executor, _create_folders, folders)
+        place_file = place_media_file
+        if journal is not None:
+            place_file = functools.partial(_place_media_file_checkpointed, journal=journal,
+                                           content_hashes=content_hashes)
+        
+        async def place(job):
+            nonlocal bytes_written
+            dest_path, (source_path, mode) = job
+            written = await loop.run_in_executor(executor, place_file, source_path, dest_path, mode)
+            bytes_written += written
+            _update_progress(progress, bytes_copied=bytes_written)
+        
+        # Stored copies go first since page entries may link to them
+        for jobs in (type_jobs, page_jobs):
+            await _run_bounded(jobs.items(), place, copy_workers, copy_workers * 2)
+    
+    return copied_count, missing_count, bytes_written, dedup_stats
+
+# Already compressed file types, stored in result archives without recompressing them
+COMPRESSED_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.mov', '.m4v', '.webm',
+    '.mp3', '.m4a', '.aac', '.ogg', '.zip', '.gz', '.pdf',
+)
+
+def write_results_archive(output_folder, archive_file):
+    """
+    Write every file in the output folder into a ZIP archive.
+
+    Files are streamed into the archive one at a time, so memory use does not depend
+    on the size of the results. Text outputs are deflated while media that is already
+    compressed is stored as is.
+
+    Args:
+        output_folder (str): Folder holding the extraction results
+        archive_file (str or file): Path or writable binary file object for the archive
+    """
+    import zipfile
+    with zipfile.ZipFile(archive_file, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for root, _, files in os.walk(output_folder):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arc_name = os.path.relpath(file_path, output_folder)
+                if file.lower().endswith(COMPRESSED_EXTENSIONS):
+                    zip_file.write(file_path, arc_name, compress_type=zipfile.ZIP_STORED)
+                else:
+                    zip_file.write(file_path, arc_name)
+
+# Name of the machine-readable metrics written in profiling mode
+METRICS_FILENAME = "media_extraction_metrics.json"
+
+# Number of slowest XML files listed in the profiling report
+SLOWEST_FILES_LISTED = 10
+
+def write_timing_report(report, metrics):
+    """
+    Write the profiling timing section to the report.
+
+    Args:
+        report (file): Open report file
+        metrics (dict): Metrics collected by extract_media_from_xml in profiling mode
+    """
+    report.write("\nTiming\n======\n")
+    for name, stage in metrics['stages'].items():
+        report.write(f"{name}: {stage['wall_seconds']:.3f}s wall, {stage['cpu_seconds']:.3f}s CPU, "
+                     f"{stage['items']} items\n")
+    total = metrics['total']
+    report.write(f"total: {total['wall_seconds']:.3f}s wall, {total['cpu_seconds']:.3f}s CPU\n")
+    
+    if metrics['slowest_files']:
+        report.write("\nSlowest XML files\n")
+        for entry in metrics['slowest_files']:
+            report.write(f"  - {entry['xml_file']}: {entry['wall_seconds']:.3f}s wall, "
+                         f"{entry['cpu_seconds']:.3f}s CPU, {entry['media']} media\n")
+
+def _start_extraction(output_folder, book_xml_path, incremental, link_mode, profile, progress, rules=None,
+                      page_index_folder=None, hash_media=False, resume=False, parser='auto', export_formats=('csv',)):
+    """
+    Check the options, load the book XML and set up the state of one extraction run.
+
+    Shared by extract_media_from_xml and extract_media_async, which pass the returned
+    state on to the other extraction helpers.
+
+    Returns:
+        dict: Run state (metrics, sorter, page titles, manifest and counters)
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode: {link_mode}")
+    # Before anything is written, so a missing package doesn't fail the run after parsing
+    check_export_formats(export_formats)
+    rules = [MediaRule(*rule) for rule in rules or DEFAULT_RULES]
+    parser = resolve_parser(parser)
+    
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
     
-    # Dictionary to store media references
-    media_references = {}
+    # Per-stage and per-file timings, only collected when profiling
+    metrics = {'stages': {}, 'files': []} if profile else None
+    run_started = _stage_clock()
+    
+    _update_progress(progress, stage='loading book XML', files_total=0, files_parsed=0,
+                     media_found=0, references=0, bytes_copied=0, media_by_type={})
     
     # Dictionary to map page IDs to their titles from book XML
     page_id_to_title = {}
     
+    # Previous results, only consulted in incremental mode
+    manifest = load_manifest(output_folder) if incremental else None
+    book_cache_hit = False
+    book_sha256 = None
+    cached_book = None
+    
     # Load book XML if provided
+    stage_started = _stage_clock()
     if book_xml_path and os.path.exists(book_xml_path):
         try:
-            book_tree = ET.parse(book_xml_path)
-            book_root = book_tree.getroot()
-            
-            # Extract all page_node elements and their titles
-            for page_node in book_root.findall('.//page_node'):
-                if 'id' in page_node.attrib and 'title' in page_node.attrib:
-                    page_id = page_node.attrib['id']
-                    page_title = page_node.attrib['title']
-                    page_id_to_title[page_id] = page_title
-                    
-            print(f"Loaded {len(page_id_to_title)} page mappings from book XML")
+            if incremental:
+                book_signature = _file_signature(book_xml_path)
+                cached_book = manifest.get('book_xml')
+                if _manifest_entry_is_current(cached_book, book_xml_path, book_signature):
+                    page_id_to_title = cached_book['page_id_to_title']
+                    book_cache_hit = True
+                    index_source = 'manifest'
+                else:
+                    book_sha256 = _file_digest(book_xml_path)
+                    page_id_to_title, index_source = load_page_index(book_xml_path, page_index_folder,
+                                                                     book_sha256, parser)
+                    cached_book = dict(book_signature, sha256=book_sha256, page_id_to_title=page_id_to_title)
+                book_sha256 = cached_book['sha256']
+            else:
+                book_sha256 = _file_digest(book_xml_path)
+                page_id_to_title, index_source = load_page_index(book_xml_path, page_index_folder, book_sha256, parser)
+            print(f"Loaded {len(page_id_to_title)} page mappings from book XML (page index: {index_source})")
         except Exception as e:
+            page_id_to_title = {}
             print(f"Error loading book XML: {str(e)}")
+    _record_stage(metrics, 'book_xml', stage_started, len(page_id_to_title))
+    
+    rule_entries = [list(rule) for rule in rules]
+    if incremental:
+        # Cached media depend on the book XML page titles and on the media rules,
+        # so a different book or different rules invalidate them
+        if manifest.get('book_sha256') != book_sha256 or manifest.get('rules') != rule_entries:
+            manifest['files'] = {}
+        manifest['book_sha256'] = book_sha256
+        manifest['book_xml'] = cached_book
+        manifest['rules'] = rule_entries
+    
+    if resume:
+        # Sort runs left behind by the interrupted run
+        import shutil
+        for entry in os.scandir(output_folder):
+            if entry.name.startswith('.media_sort_') and entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+    # Journal of the XML files parsed and media placed, so an interrupted run can be resumed
+    journal = CheckpointJournal(output_folder, {'book_sha256': book_sha256, 'rules': rule_entries,
+                                                'link_mode': link_mode, 'hash_media': hash_media}, resume)
+    if resume and not journal.resumed:
+        print("No checkpoint journal for these options in the output folder, starting from scratch")
+    
+    return {
+        'output_folder': output_folder,
+        'book_xml_path': book_xml_path,
+        'incremental': incremental,
+        'hash_media': hash_media,
+        'progress': progress,
+        'metrics': metrics,
+        'run_started': run_started,
+        'page_id_to_title': page_id_to_title,
+        # Lets processes of a shared worker pool look the page titles up in the page index
+        'book_key': (book_xml_path, book_sha256, page_index_folder) if page_id_to_title else None,
+        'rules': compile_rules(rules),
+        # Parser backend, resolved once so worker processes don't check for lxml again
+        'parser': parser,
+        'manifest': manifest,
+        'book_cache_hit': book_cache_hit,
+        'journal': journal,
+        # XML files whose media come from the checkpoint journal, see _check_journal
+        'resumed_media': {},
+        # Media references, deduplicated by src and sorted by page title as they stream in
+        'sorter': ExternalSorter(page_title_sort_key, temp_folder=output_folder),
+        'media_found': 0,
+        # Media found per type so far, before references are deduplicated by src
+        'media_by_type': defaultdict(int),
+        # One shared string per page title, however many references point at the page
+        'page_titles': {},
+    }
+
+def _check_cached_file(cached_files, xml_file, xml_input):
+    """
+    Compare an XML input with its entry in the incremental manifest.
+
+    Returns:
+        tuple: (manifest_entry, cached_media) where cached_media is None when the
+        file changed and has to be parsed again
+    """
+    entry = cached_files.get(xml_file)
+    signature = _file_signature(xml_input)
+    if _manifest_entry_is_current(entry, xml_input, signature):
+        return entry, [tuple(media) for media in entry['media']]
+    return dict(signature, sha256=_file_digest(xml_input)), None
+
+def _xml_checksum(run, xml_file, xml_input):
+    """Return the (size, sha256) of an XML input, reusing the digest of the incremental manifest if any."""
+    entry = run['manifest']['files'].get(xml_file) if run['incremental'] else None
+    if entry and entry.get('sha256'):
+        return entry['size'], entry['sha256']
+    return _file_signature(xml_input)['size'], _file_digest(xml_input)
+
+def _check_journal_file(run, xml_file, xml_input):
+    """
+    Look an XML input up in the checkpoint journal of a resumed run.
+
+    Returns:
+        list: The journalled media of the file, or None when it is not journalled
+        or its size or content hash changed, so it has to be parsed again
+    """
+    entry = run['journal'].xml_files.get(xml_file)
+    if entry is None or entry['size'] != _file_signature(xml_input)['size']:
+        return None
+    if entry['sha256'] != _xml_checksum(run, xml_file, xml_input)[1]:
+        return None
+    return [tuple(media) for media in entry['media']]
+
+def _resume_xml_files(run, xml_files, journal_checks):
+    """
+    Keep the journalled media of the XML files a resumed run does not parse again.
+
+    Args:
+        run (dict): Run state from _start_extraction
+        xml_files (list): Names of the XML files checked against the journal
+        journal_checks (list): _check_journal_file results in xml_files order
+    """
+    resumed_media = run['resumed_media']
+    for xml_file, media in zip(xml_files, journal_checks):
+        if media is not None:
+            resumed_media[xml_file] = media
+    print(f"Resuming: {len(resumed_media)} XML files already parsed")
+
+def _write_input_summary(run, report, xml_files, cache_checks):
+    """
+    Write the number of XML files found and, in incremental mode, the cache hits and misses.
+
+    Args:
+        run (dict): Run state from _start_extraction
+        report (file): Open report file
+        xml_files (list): Names of the XML files to process
+        cache_checks (list or None): _check_cached_file results in xml_files order,
+            only given in incremental mode
+
+    Returns:
+        dict: Cached media of the unchanged XML files, by file name
+    """
+    report.write(f"Found {len(xml_files)} XML files to process.\n")
+    _update_progress(run['progress'], stage='parsing XML files', files_total=len(xml_files))
+    
+    # Work out which files can be reused from the manifest
+    cached_media = {}
+    if run['incremental']:
+        manifest = run['manifest']
+        manifest['files'] = {}
+        for xml_file, (entry, media) in zip(xml_files, cache_checks):
+            manifest['files'][xml_file] = entry
+            if media is not None:
+                cached_media[xml_file] = media
+        cache_misses = len(xml_files) - len(cached_media)
+        report.write(f"Incremental cache: {len(cached_media)} hits, {cache_misses} misses\n")
+        if run['book_xml_path']:
+            report.write(f"Book XML page map: {'reused from cache' if run['book_cache_hit'] else 'rebuilt'}\n")
+    report.write("\n")
+    return cached_media
+
+def _record_file_result(run, report, files_parsed, xml_file, file_media, error, timing):
+    """
+    Write the findings for one XML file to the report and add its media to the sorter.
+
+    Args:
+        run (dict): Run state from _start_extraction
+        report (file): Open report file
+        files_parsed (int): Number of files handled so far, including this one
+        xml_file (str): Name of the XML file
+        file_media (list or None): Media found by collect_file_media
+        error (str or None): Error message if the file could not be parsed
+        timing (tuple or None): (wall_seconds, cpu_seconds) spent parsing the file,
+            or None when its media came from the incremental cache
+    """
+    if run['incremental'] and timing is not None:
+        if error is None:
+            run['manifest']['files'][xml_file]['media'] = file_media
+        else:
+            # Don't cache failures so the file is retried next run
+            del run['manifest']['files'][xml_file]
+    _update_progress(run['progress'], files_parsed=files_parsed, media_found=run['media_found'])
+    if run['metrics'] is not None:
+        run['metrics']['files'].append({
+            'xml_file': xml_file,
+            'cached': timing is None,
+            'wall_seconds': timing[0] if timing else 0.0,
+            'cpu_seconds': timing[1] if timing else 0.0,
+            'media': len(file_media or []),
+            'error': error,
+        })
+    
+    if error is not None:
+        report.write(f"Error processing {xml_file}: {error}\n\n")
+        return
+    
+    # Log the findings for this file
+    if file_media:
+        page_titles = run['page_titles']
+        report.write(f"File: {xml_file}\n")
+        for media_type, src, title, page_id, page_title in file_media:
+            report.write(f"  - {media_type}: {title} (src: {src})\n")
+            report.write(f"    Page: {page_title} (ID: {page_id})\n")
+            # Add to overall media references
+            page_title = page_titles.setdefault(page_title, page_title)
+            run['sorter'].add(src, MediaReference(media_type, title, xml_file, page_id, page_title))
+            run['media_found'] += 1
+            run['media_by_type'][media_type] += 1
+        report.write("\n")
+        # A fresh copy, so another thread can read it while the next file is counted
+        _update_progress(run['progress'], media_by_type=dict(run['media_by_type']))
+
+def _export_references(run, report, export_formats, media_folder=None, hash_workers=8):
+    """
+    Sort the media references, export them and write the summary section of the report.
+
+    When the run hashes media, the referenced media files are hashed between sorting
+    and exporting, and the exports get a sha256 column.
+
+    Args:
+        run (dict): Run state from _start_extraction
+        report (file): Open report file
+        export_formats (list): Formats from media_export.EXPORTERS
+        media_folder (str or file, optional): Folder containing the actual media files,
+            or a ZIP archive
+        hash_workers (int, optional): Number of media files hashed concurrently
+    """
+    metrics = run['metrics']
+    sorter = run['sorter']
+    _update_progress(run['progress'], stage='writing report', media_found=run['media_found'])
+    
+    # Sort media references by page title
+    stage_started = _stage_clock()
+    sorter.finish()
+    _record_stage(metrics, 'sort', stage_started, run['media_found'])
+    
+    # Hash the referenced media files to find duplicates and basename collisions
+    columns = EXPORT_COLUMNS
+    media_index = content_hashes = None
+    if run['hash_media'] and _has_media_folder(media_folder):
+        _update_progress(run['progress'], stage='hashing media')
+        stage_started = _stage_clock()
+        media_index, content_hashes = hash_media_files(sorter, media_folder, hash_workers)
+        run['media_index'], run['content_hashes'] = media_index, content_hashes
+        _record_stage(metrics, 'hash', stage_started, len(content_hashes))
+        columns = EXPORT_COLUMNS + [HASH_COLUMN]
+    
+    # Export all media references, counting them per type on the way
+    stage_started = _stage_clock()
+    type_counts = defaultdict(int)
+    exporters = open_exporters(run['output_folder'], export_formats, columns)
+    try:
+        for src, reference in sorter:
+            type_counts[reference.media_type] += 1
+            extra = ()
+            if content_hashes is not None:
+                source_path = resolve_media_source(media_index, src)
+                extra = (content_hashes[source_path][0] if source_path is not None else None,)
+            for exporter in exporters:
+                exporter.write(src, reference, *extra)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    reference_count = sum(type_counts.values())
+    _update_progress(run['progress'], references=reference_count, type_counts=dict(type_counts))
+    _record_stage(metrics, 'export', stage_started, reference_count)
+    
+    # Summary section
+    report.write("\nSummary\n=======\n")
+    report.write(f"Total media files referenced: {reference_count}\n")
+    report.write(f"Images: {type_counts['image']}\n")
+    report.write(f"Videos: {type_counts['video']}\n")
+    report.write(f"Audio: {type_counts['audio']}\n")
+    # Media types added through rules
+    for media_type in run['rules'].media_types:
+        if media_type not in ('image', 'video', 'audio'):
+            report.write(f"{media_type.capitalize()}: {type_counts[media_type]}\n")
+    if content_hashes is not None:
+        distinct_contents = len({content_hash for content_hash, _ in content_hashes.values()})
+        report.write(f"Media files hashed: {len(content_hashes)} ({distinct_contents} distinct contents)\n")
+    report.write("\n")
+    
+    for exporter in exporters:
+        report.write(f"{exporter.label} export of all media references created at: {exporter.path}\n")
+
+def _has_media_folder(media_folder):
+    """Check whether media files were provided to copy."""
+    return bool(media_folder) and (is_zip_source(media_folder) or os.path.exists(media_folder))
+
+def _start_copy_report(run, report):
+    """Write the heading of the copy section and return the stage start clock."""
+    report.write("\nMedia File Copy Results\n=====================\n")
+    _update_progress(run['progress'], stage='copying media')
+    return _stage_clock()
+
+def _write_copy_results(run, report, stage_started, link_mode, copied_count, missing_count, bytes_written,
+                        dedup_stats):
+    """Write the outcome of the copy stage to the report."""
+    media_output_folder = os.path.join(run['output_folder'], "media")
+    report.write(f"\nCopied {copied_count} media files to {media_output_folder}\n")
+    report.write(f"Missing media files: {missing_count}\n")
+    report.write(f"Bytes written: {bytes_written} (link mode: {link_mode})\n")
+    _update_progress(run['progress'], media_copied=copied_count, media_missing=missing_count)
+    if dedup_stats['collisions']:
+        report.write(f"Basename collisions: {dedup_stats['collisions']} (stored under suffixed names)\n")
+    if run['hash_media']:
+        report.write(f"Duplicate media files: {dedup_stats['duplicates']} "
+                     f"({dedup_stats['duplicate_bytes']} bytes not stored again)\n")
+    _record_stage(run['metrics'], 'copy', stage_started, copied_count)
+
+def _finish_report(run, report, return_references):
+    """
+    Write the profiling section, if profiling, and collect the references to return.
+
+    Returns:
+        dict: Sorted media references, or None when return_references is False
+    """
+    metrics = run['metrics']
+    if metrics is not None:
+        wall_started, cpu_started = run['run_started']
+        metrics['total'] = {
+            'wall_seconds': time.perf_counter() - wall_started,
+            'cpu_seconds': time.process_time() - cpu_started,
+        }
+        parsed_files = [entry for entry in metrics['files'] if not entry['cached']]
+        metrics['slowest_files'] = sorted(parsed_files, key=lambda entry: entry['wall_seconds'],
+                                          reverse=True)[:SLOWEST_FILES_LISTED]
+        write_timing_report(report, metrics)
+        
+        metrics_path = os.path.join(run['output_folder'], METRICS_FILENAME)
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        report.write(f"\nMetrics exported to: {metrics_path}\n")
+    
+    return dict(run['sorter']) if return_references else None
+
+def _finish_extraction(run, report_path):
+    """Save the incremental manifest, drop the checkpoint journal and mark the run as done."""
+    if run['incremental']:
+        save_manifest(run['output_folder'], run['manifest'])
+    
+    # The run completed, so there is nothing left to resume
+    journal = run['journal']
+    journal.remove()
+    if journal.resumed:
+        print(f"Resumed: {len(run['resumed_media'])} XML files and {journal.media_reused} media files "
+              f"were reused from the checkpoint journal")
+    
+    _update_progress(run['progress'], stage='done')
+    print(f"Media extraction complete. Report saved to {report_path}")
+
+def extract_media_from_xml(xml_folder, output_folder, book_xml_path=None, media_folder=None,
+                           workers=1, incremental=False, link_mode='copy',
+                           copy_workers=8, progress=None, profile=False, export_formats=('csv',),
+                           return_references=True, rules=None, page_index_folder=None, hash_media=False,
+                           executor=None, resume=False, parser='auto'):
+    """
+    Extract all media files referenced in XML files and organize them in the output folder.
+    
+    Args:
+        xml_folder (str or file): Path to the folder containing XML files, or a ZIP archive
+            (path or binary file object) whose XML entries are read without extracting them
+        output_folder (str): Path to save extracted media references
+        book_xml_path (str, optional): Path to the book XML file containing page titles
+        media_folder (str or file, optional): Path to the folder containing actual media files,
+            or a ZIP archive from which only referenced files are extracted
+        workers (int, optional): Number of processes used to parse XML files (1 parses in-process)
+        incremental (bool, optional): Reuse results for unchanged XML files from the manifest
+            kept in the output folder, and only reparse files that changed
+        link_mode (str, optional): How media is placed in the output trees. 'copy' copies
+            every file into both the type and page trees; 'hardlink', 'symlink' and 'reflink'
+            store each file once under media/<type>s/ and link the page tree to it
+        copy_workers (int, optional): Maximum number of concurrent media copies
+        progress (dict, optional): Updated in place while the extraction runs, so another
+            thread can follow it. Keys are 'stage', 'files_total', 'files_parsed',
+            'media_found', 'references' and 'bytes_copied', plus 'media_by_type' (media
+            found per type while parsing), 'type_counts' (references per type once
+            exported) and 'media_copied' and 'media_missing' after the copy stage
+        profile (bool, optional): Record wall time, CPU time and item counts per stage and
+            per XML file, add a timing section to the report and export the metrics to
+            media_extraction_metrics.json in the output folder
+        export_formats (list, optional): Formats the media references are exported in,
+            any of media_export.EXPORTERS ('csv', 'jsonl', 'parquet')
+        return_references (bool, optional): Build and return the sorted media references
+            dict. Without it, references are only streamed through an external merge sort
+            to the exports and the copy stage, so memory does not grow with their number
+        rules (list, optional): media_rules.MediaRule entries selecting which elements are
+            extracted as which media type; media_rules.DEFAULT_RULES (image, video and
+            audio nodes) when not given
+        page_index_folder (str or bool, optional): Folder where book XML page maps are
+            indexed by content hash for reuse across runs, see load_page_index. Defaults
+            to a folder in the user cache; False keeps them in memory only
+        hash_media (bool, optional): Hash the referenced media files in parallel, store
+            byte-identical files only once, add dedup statistics to the report and a
+            sha256 column to the exports
+        executor (ProcessPoolExecutor, optional): Parse worker pool shared across calls,
+            see run_batch; workers then sets the chunk size only
+        resume (bool, optional): Continue a run into the same output folder that was
+            interrupted. The XML files parsed and media files placed are journalled in
+            media_extraction_journal.jsonl as the run goes; when resuming, those whose
+            size and content hash still match are not parsed or placed again. The
+            report and exports are the same as those of an uninterrupted run
+        parser (str, optional): XML parser backend, one of media_parsers.PARSERS: 'etree'
+            (ElementTree), 'lxml', 'scan' (memory-mapped scanner that doesn't build a
+            tree) or 'auto', which uses lxml when it is installed. lxml and scan fall
+            back to ElementTree for files they can't handle, so the outputs are the same
+    
+    Returns:
+        dict: Sorted media references mapping each src to a MediaReference, or None
+        when return_references is False
+    """
+    run = _start_extraction(output_folder, book_xml_path, incremental, link_mode, profile, progress, rules,
+                            page_index_folder, hash_media, resume, parser, export_formats)
     
     # Create a report file
     report_path = os.path.join(output_folder, "media_extraction_report.txt")
     
-    with open(report_path, 'w') as report:
+    with open(report_path, 'w') as report, _closing_archives(xml_folder, media_folder), run['sorter'], run['journal']:
         report.write("XML Media Extraction Report\n")
         report.write("==========================\n\n")
         
         # Process all XML files in the folder
-        xml_files = [f for f in os.listdir(xml_folder) if f.endswith('.xml')]
-        report.write(f"Found {len(xml_files)} XML files to process.\n\n")
+        xml_inputs = list_xml_inputs(xml_folder)
+        xml_files = [xml_file for xml_file, _ in xml_inputs]
+        cache_checks = None
+        if incremental:
+            cached_files = run['manifest']['files']
+            cache_checks = [_check_cached_file(cached_files, xml_file, xml_input)
+                            for xml_file, xml_input in xml_inputs]
+        cached_media = _write_input_summary(run, report, xml_files, cache_checks)
+        
+        # When resuming, files parsed before the interruption are taken from the journal
+        journal = run['journal']
+        resumed_media = run['resumed_media']
+        if journal.resumed:
+            unchecked = [(xml_file, xml_input) for xml_file, xml_input in xml_inputs if xml_file not in cached_media]
+            _resume_xml_files(run, [xml_file for xml_file, _ in unchecked],
+                              [_check_journal_file(run, xml_file, xml_input) for xml_file, xml_input in unchecked])
+        
+        # Only files that are not cached need parsing; results come back in xml_files order
+        stage_started = _stage_clock()
+        parsed = parse_xml_files([(xml_file, xml_input) for xml_file, xml_input in xml_inputs
+                                  if xml_file not in cached_media and xml_file not in resumed_media],
+                                 run['page_id_to_title'], workers, run['rules'], executor, run['book_key'],
+                                 run['parser'])
         
-        for xml_file in xml_files:
-            xml_path = os.path.join(xml_folder, xml_file)
+        for files_parsed, (xml_file, xml_input) in enumerate(xml_inputs, 1):
+            if xml_file in cached_media:
+                file_media, error, timing = cached_media[xml_file], None, None
+            elif xml_file in resumed_media:
+                # Recorded like a parsed file, so the report and manifest are the same as without the interruption
+                file_media, error, timing = resumed_media[xml_file], None, (0.0, 0.0)
+            else:
+                _, file_media, error, timing, checksum = next(parsed)
+                if error is None:
+                    journal.record_xml(xml_file, *checksum, file_media)
+            _record_file_result(run, report, files_parsed, xml_file, file_media, error, timing)
+        
+        _record_stage(run['metrics'], 'parse', stage_started, len(xml_files))
+        _export_references(run, report, export_formats, media_folder, copy_workers)
+        
+        # If media folder is provided, copy the files
+        if _has_media_folder(media_folder):
+            stage_started = _start_copy_report(run, report)
+            counts = copy_media_files(
+                run['sorter'], media_folder, output_folder, report,
+                link_mode=link_mode, copy_workers=copy_workers, progress=progress,
+                content_hashes=run.get('content_hashes'), media_index=run.get('media_index'),
+                journal=run['journal']
+            )
+            _write_copy_results(run, report, stage_started, link_mode, *counts)
+        
+        media_references = _finish_report(run, report, return_references)
+    
+    _finish_extraction(run, report_path)
+    return media_references
+
+# Default number of threads reading XML files in extract_media_async
+DEFAULT_READ_WORKERS = 16
+
+# Default number of XML files extract_media_async holds between listing and the report
+DEFAULT_QUEUE_SIZE = 64
+
+# Default number of bytes of XML content extract_media_async reads ahead of the parser
+DEFAULT_READ_BUFFER_BYTES = 256 * 1024 * 1024
+
+def _xml_input_size(xml_input):
+    """Return the size in bytes of an XML input from list_xml_inputs."""
+    if isinstance(xml_input, tuple):
+        source, member = xml_input
+        return open_archive(source).getinfo(member).file_size
+    return os.path.getsize(xml_input)
+
+async def _parse_pipeline(run, report, xml_inputs, cached_media, workers, read_workers, queue_size,
+                          read_buffer_bytes=DEFAULT_READ_BUFFER_BYTES):
+    """
+    Read and parse XML files through bounded asyncio stages and report them in order.
+
+    Files are read by read_workers threads, then parsed on an executor (a process pool
+    when workers > 1, otherwise one thread), each stage fed by a bounded queue. Results
+    are written in xml_inputs order. At most queue_size files are in flight between
+    listing and the report, so a single slow file holds back the reads instead of
+    letting parsed results pile up in memory.
+    
+    Memory is bounded by bytes: a file is only read ahead once its size fits in
+    read_buffer_bytes together with the files read but not parsed yet. Files larger
+    than read_buffer_bytes are not read ahead at all; the parser streams them from
+    their path or archive member, as extract_media_from_xml does.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    page_id_to_title = run['page_id_to_title']
+    rules = run['rules']
+    parser = run['parser']
+    journal = run['journal']
+    resumed_media = run['resumed_media']
+    read_queue = asyncio.Queue(maxsize=queue_size)
+    parse_queue = asyncio.Queue(maxsize=queue_size)
+    # (xml_file, result future) in listing order, bounded by in_flight
+    order_queue = asyncio.Queue()
+    in_flight = asyncio.Semaphore(queue_size)
+    # Bytes read ahead and not parsed yet, bounded by read_buffer_bytes
+    buffered = {'bytes': 0}
+    buffer_changed = asyncio.Condition()
+    
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    if workers > 1:
+        parse_executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker,
+                                             initargs=(page_id_to_title, rules, parser))
+        parse_task = _parse_xml_file_task
+        parse_concurrency = workers * 2
+    else:
+        parse_executor = ThreadPoolExecutor(max_workers=1)
+        parse_task = functools.partial(_parse_xml_file, page_id_to_title=page_id_to_title, rules=rules,
+                                       parser=parser)
+        parse_concurrency = 1
+    read_executor = ThreadPoolExecutor(max_workers=max(1, read_workers))
+    
+    async def list_files():
+        for xml_file, xml_input in xml_inputs:
+            await in_flight.acquire()
+            result = loop.create_future()
+            if xml_file in cached_media:
+                result.set_result((cached_media[xml_file], None, None, None))
+            elif xml_file in resumed_media:
+                # Recorded like a parsed file, as in extract_media_from_xml
+                result.set_result((resumed_media[xml_file], None, (0.0, 0.0), None))
+            else:
+                await read_queue.put((xml_file, xml_input, result))
+            await order_queue.put((xml_file, result))
+        await order_queue.put(None)
+    
+    async def reserve(size):
+        async with buffer_changed:
+            await buffer_changed.wait_for(lambda: buffered['bytes'] + size <= read_buffer_bytes)
+            buffered['bytes'] += size
+    
+    async def release(size):
+        async with buffer_changed:
+            buffered['bytes'] -= size
+            buffer_changed.notify_all()
+    
+    async def read_files():
+        while True:
+            xml_file, xml_input, result = await read_queue.get()
+            reserved = 0
+            try:
+                size = await loop.run_in_executor(read_executor, _xml_input_size, xml_input)
+                if size > read_buffer_bytes:
+                    # Too large to read ahead; parsed straight from its path or archive member
+                    await parse_queue.put((xml_input, result, 0))
+                    continue
+                await reserve(size)
+                reserved = size
+                data = await loop.run_in_executor(read_executor, _read_xml_input, xml_input)
+            except Exception as e:
+                if reserved:
+                    await release(reserved)
+                # Reported like a parse error, as the synchronous pipeline does
+                result.set_result((None, str(e), (0.0, 0.0), None))
+                continue
+            await parse_queue.put((data, result, reserved))
+    
+    async def parse_files():
+        while True:
+            data, result, size = await parse_queue.get()
             try:
-                tree = ET.parse(xml_path)
-                root = tree.getroot()
-                
-                # Track media in current file
-                file_media = []
-                
-                # Get the page_node id in different ways
-                page_id = None
-                page_title = "Unknown Page"
-                
-                # Check if root has a page_node child
-                page_nodes = root.findall('./page_node')
-                if page_nodes:
-                    page_node = page_nodes[0]  # Get the first page_node
-                    if 'id' in page_node.attrib:
-                        page_id = page_node.attrib['id']
-                    if 'title' in page_node.attrib:
-                        page_title = page_node.attrib['title']
-                # Or if the root itself is a page_node
-                elif root.tag == 'page_node' and 'id' in root.attrib:
-                    page_id = root.attrib['id']
-                    if 'title' in root.attrib:
-                        page_title = root.attrib['title']
-                
-                # If a book XML was provided, use its title mapping if available
-                if page_id and page_id in page_id_to_title:
-                    page_title = page_id_to_title[page_id]
-                
-                # Find all image_node elements in the entire XML tree
-                image_nodes = root.findall('.//image_node')
-                for img in image_nodes:
-                    if 'src' in img.attrib:
-                        src = img.attrib['src']
-                        title = img.attrib.get('title', 'No Title')
-                        file_media.append(('image', src, title, page_id, page_title))
-                
-                # Find all video_node elements (assuming similar structure)
-                video_nodes = root.findall('.//video_node')
-                for vid in video_nodes:
-                    if 'src' in vid.attrib:
-                        src = vid.attrib['src']
-                        title = vid.attrib.get('title', 'No Title')
-                        file_media.append(('video', src, title, page_id, page_title))
-                
-                # Also check for audio_node elements
-                audio_nodes = root.findall('.//audio_node')
-                for audio in audio_nodes:
-                    if 'src' in audio.attrib:
-                        src = audio.attrib['src']
-                        title = audio.attrib.get('title', 'No Title')
-                        file_media.append(('audio', src, title, page_id, page_title))
-                
-                # Log the findings for this file
-                if file_media:
-                    report.write(f"File: {xml_file}\n")
-                    for media_type, src, title, page_id, page_title in file_media:
-                        report.write(f"  - {media_type}: {title} (src: {src})\n")
-                        report.write(f"    Page: {page_title} (ID: {page_id})\n")
-                        # Add to overall media references dict
-                        media_references[src] = (media_type, title, xml_file, page_id, page_title)
-                    report.write("\n")
-                
+                result.set_result(await loop.run_in_executor(parse_executor, parse_task, data))
             except Exception as e:
-                report.write(f"Error processing {xml_file}: {str(e)}\n\n")
-        
-        # Sort media references by page title
-        media_references = sort_media_references(media_references)
-        
-        # Summary section
-        report.write("\nSummary\n=======\n")
-        report.write(f"Total media files referenced: {len(media_references)}\n")
-        report.write(f"Images: {sum(1 for media_type, _, _, _, _ in media_references.values() if media_type == 'image')}\n")
-        report.write(f"Videos: {sum(1 for media_type, _, _, _, _ in media_references.values() if media_type == 'video')}\n")
-        report.write(f"Audio: {sum(1 for media_type, _, _, _, _ in media_references.values() if media_type == 'audio')}\n\n")
-        
-        # Create a CSV of all media references
-        csv_path = os.path.join(output_folder, "media_references.csv")
-        with open(csv_path, 'w') as csv:
-            csv.write("media_type,source,title,xml_file,page_id,page_title\n")
-            for src, (media_type, title, xml_file, page_id, page_title) in media_references.items():
-                # Escape commas in fields that might contain them
-                safe_title = f'"{title}"' if ',' in title else title
-                safe_page_title = f'"{page_title}"' if ',' in page_title else page_title
-                csv.write(f"{media_type},{src},{safe_title},{xml_file},{page_id},{safe_page_title}\n")
-        
-        report.write(f"CSV export of all media references created at: {csv_path}\n")
+                # Only a broken executor gets here; parse errors are returned as results
+                result.set_exception(e)
+            finally:
+                del data
+                if size:
+                    await release(size)
+    
+    if workers > 1:
+        # Start the worker processes before any reader thread exists, so they are
+        # never forked while a read holds a lock
+        await loop.run_in_executor(parse_executor, int)
+    
+    tasks = [asyncio.ensure_future(list_files())]
+    tasks += [asyncio.ensure_future(read_files()) for _ in range(max(1, read_workers))]
+    tasks += [asyncio.ensure_future(parse_files()) for _ in range(parse_concurrency)]
+    try:
+        files_parsed = 0
+        while True:
+            item = await order_queue.get()
+            if item is None:
+                break
+            xml_file, result = item
+            file_media, error, timing, checksum = await result
+            # Files parsed in this run are journalled with the checksum computed while parsing
+            if error is None and checksum is not None:
+                journal.record_xml(xml_file, *checksum, file_media)
+            files_parsed += 1
+            # Report writes are buffered, so they stay on the event loop
+            _record_file_result(run, report, files_parsed, xml_file, file_media, error, timing)
+            in_flight.release()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        read_executor.shutdown(wait=False)
+        parse_executor.shutdown(wait=True)
+
+async def extract_media_async(xml_folder, output_folder, book_xml_path=None, media_folder=None,
+                              workers=1, incremental=False, link_mode='copy',
+                              copy_workers=8, progress=None, profile=False, export_formats=('csv',),
+                              return_references=True, rules=None, page_index_folder=None,
+                              hash_media=False, read_workers=DEFAULT_READ_WORKERS,
+                              queue_size=DEFAULT_QUEUE_SIZE, resume=False, parser='auto',
+                              read_buffer_bytes=DEFAULT_READ_BUFFER_BYTES):
+    """
+    Asynchronous version of extract_media_from_xml for high-latency storage.
+
+    Listing, reading, parsing and copying run as separate asyncio stages connected by
+    bounded queues, so many files are read at once while the content read ahead of
+    the parser stays within read_buffer_bytes. This
+    pays off when per-file latency dominates, for example on network or object store
+    mounts. The outputs are the same as those of extract_media_from_xml.
+
+    Args:
+        xml_folder, output_folder, book_xml_path, media_folder, workers, incremental,
+        link_mode, copy_workers, progress, profile, export_formats, return_references, rules,
+        page_index_folder, hash_media, resume, parser: Same as extract_media_from_xml
+        read_workers (int, optional): Number of XML files read concurrently
+        queue_size (int, optional): Maximum number of XML files held between listing
+            and the report, and the size of each stage queue
+        read_buffer_bytes (int, optional): Maximum number of bytes of XML content read
+            ahead of the parser; larger files are streamed by the parser instead
+
+    Returns:
+        dict: Sorted media references mapping each src to a MediaReference, or None
+        when return_references is False
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    queue_size = max(1, queue_size)
+    run = await loop.run_in_executor(None, _start_extraction, output_folder, book_xml_path,
+                                     incremental, link_mode, profile, progress, rules, page_index_folder,
+                                     hash_media, resume, parser, export_formats)
+    
+    # Create a report file
+    report_path = os.path.join(output_folder, "media_extraction_report.txt")
+    
+    with open(report_path, 'w') as report, _closing_archives(xml_folder, media_folder), run['sorter'], run['journal']:
+        report.write("XML Media Extraction Report\n")
+        report.write("==========================\n\n")
         
-        # If media folder is provided, copy the files
-        if media_folder and os.path.exists(media_folder):
-            media_output_folder = os.path.join(output_folder, "media")
-            os.makedirs(media_output_folder, exist_ok=True)
-            
-            # Create a page-based media organization
-            page_based_folder = os.path.join(output_folder, "media_by_page")
-            os.makedirs(page_based_folder, exist_ok=True)
+        # Listing stage; in incremental mode the files are checked against the manifest
+        # concurrently, since each check reads the file
+        xml_inputs = await loop.run_in_executor(None, list_xml_inputs, xml_folder)
+        xml_files = [xml_file for xml_file, _ in xml_inputs]
+        cache_checks = None
+        if incremental:
+            cached_files = run['manifest']['files']
+            cache_checks = [None] * len(xml_inputs)
             
-            copied_count = 0
-            missing_count = 0
+            async def check(item):
+                index, (xml_file, xml_input) = item
+                cache_checks[index] = await loop.run_in_executor(
+                    None, _check_cached_file, cached_files, xml_file, xml_input)
             
-            report.write("\nMedia File Copy Results\n=====================\n")
+            await _run_bounded(enumerate(xml_inputs), check, read_workers, queue_size)
+        cached_media = _write_input_summary(run, report, xml_files, cache_checks)
+        
+        # When resuming, files parsed before the interruption are taken from the journal
+        if run['journal'].resumed:
+            unchecked = [(xml_file, xml_input) for xml_file, xml_input in xml_inputs if xml_file not in cached_media]
+            journal_checks = [None] * len(unchecked)
             
-            for src in media_references:
-                media_type, title, _, page_id, page_title = media_references[src]
-                
-                # Handle potential path differences
-                # Some systems might store just the filename in src, others might have a path
-                src_filename = os.path.basename(src)
-                
-                # Look for the media file in media_folder
-                source_path = os.path.join(media_folder, src_filename)
-                
-                if os.path.exists(source_path):
-                    # Create subdirectory for media type
-                    type_folder = os.path.join(media_output_folder, media_type + "s")
-                    os.makedirs(type_folder, exist_ok=True)
-                    
-                    # Copy the file to type-based organization
-                    dest_path = os.path.join(type_folder, src_filename)
-                    shutil.copy2(source_path, dest_path)
-                    
-                    # Create page-based organization
-                    # Format folder name to be safe for filesystem
-                    safe_page_title = page_title.replace('/', '-').replace('\\', '-')
-                    page_folder = os.path.join(page_based_folder, f"{safe_page_title}")
-                    os.makedirs(page_folder, exist_ok=True)
-                    
-                    # Copy the file to page-based organization
-                    page_dest_path = os.path.join(page_folder, src_filename)
-                    shutil.copy2(source_path, page_dest_path)
-                    
-                    copied_count += 1
-                else:
-                    report.write(f"Missing media file: {src_filename}\n")
-                    missing_count += 1
+            async def check_journal(item):
+                index, (xml_file, xml_input) = item
+                journal_checks[index] = await loop.run_in_executor(
+                    None, _check_journal_file, run, xml_file, xml_input)
             
-            report.write(f"\nCopied {copied_count} media files to {media_output_folder}\n")
-            report.write(f"Missing media files: {missing_count}\n")
+            await _run_bounded(enumerate(unchecked), check_journal, read_workers, queue_size)
+            _resume_xml_files(run, [xml_file for xml_file, _ in unchecked], journal_checks)
+        
+        stage_started = _stage_clock()
+        await _parse_pipeline(run, report, xml_inputs, cached_media, workers, read_workers, queue_size,
+                              read_buffer_bytes)
+        _record_stage(run['metrics'], 'parse', stage_started, len(xml_files))
+        
+        # Sorting and exporting are disk-bound and run off the event loop
+        await loop.run_in_executor(None, _export_references, run, report, export_formats,
+                                   media_folder, copy_workers)
+        
+        # If media folder is provided, copy the files
+        if await loop.run_in_executor(None, _has_media_folder, media_folder):
+            stage_started = _start_copy_report(run, report)
+            counts = await copy_media_files_async(
+                run['sorter'], media_folder, output_folder, report,
+                link_mode=link_mode, copy_workers=copy_workers, progress=progress,
+                content_hashes=run.get('content_hashes'), media_index=run.get('media_index'),
+                journal=run['journal']
+            )
+            _write_copy_results(run, report, stage_started, link_mode, *counts)
+        
+        media_references = await loop.run_in_executor(None, _finish_report, run, report, return_references)
     
-    print(f"Media extraction complete. Report saved to {report_path}")
+    _finish_extraction(run, report_path)
     return media_references
 
+def _add_extraction_arguments(parser):
+    """Add the extraction options shared by single-book and batch runs to a parser."""
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to parse XML files (default: 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only reparse XML files that changed since the last run into the same output folder')
+    parser.add_argument('--link-mode', choices=LINK_MODES, default='copy',
+                        help='How media files are placed in the type and page folders (default: copy)')
+    parser.add_argument('--copy-workers', type=int, default=8,
+                        help='Maximum number of media files copied concurrently (default: 8)')
+    parser.add_argument('--hash-media', action='store_true',
+                        help='Hash media files to store identical files once and detect name collisions')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-stage and per-file timings in the report and in a metrics JSON file')
+    parser.add_argument('--export-format', action='append', choices=sorted(EXPORTERS), type=parse_export_format,
+                        help='Format to export the media references in; repeat for several (default: csv)')
+    parser.add_argument('--rules', help='JSON file with the media rules to use instead of the default image, video and audio nodes')
+    parser.add_argument('--rule', action='append', type=parse_rule, metavar='TAG:SRC_ATTR:TITLE_ATTR:MEDIA_TYPE',
+                        help='Extra media rule, e.g. pdf_node:src:title:pdf or video_node:poster::image; repeat for several')
+    parser.add_argument('--page-index-folder',
+                        help='Folder where book XML page maps are indexed for reuse (default: ~/.cache/media_extraction/page_index)')
+    parser.add_argument('--no-page-index', action='store_true',
+                        help='Do not read or write the on-disk book XML page index')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run into the same output folder, skipping XML files and media already done')
+    parser.add_argument('--parser', choices=PARSERS, default='auto',
+                        help='XML parser backend; auto uses lxml when it is installed, scan is a memory-mapped '
+                             'scanner (default: auto)')
+
+def parse_export_format(text):
+    """Check an export format given on the command line, so missing packages are reported up front."""
+    if text in EXPORTERS:
+        try:
+            check_export_formats([text])
+        except ImportError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return text
+
+def _extraction_options(args):
+    """Turn the options added by _add_extraction_arguments into extract_media_from_xml arguments."""
+    # Rules from the file (or the defaults) followed by any given on the command line
+    rules = load_rules(args.rules) if args.rules else list(DEFAULT_RULES)
+    rules += args.rule or []
+    
+    page_index_folder = False if args.no_page_index else args.page_index_folder
+    
+    return dict(workers=args.workers, incremental=args.incremental, link_mode=args.link_mode,
+                copy_workers=args.copy_workers, profile=args.profile, hash_media=args.hash_media,
+                export_formats=args.export_format or ['csv'], return_references=False, rules=rules,
+                page_index_folder=page_index_folder, resume=args.resume, parser=resolve_parser(args.parser))
+
+# Default name of the aggregate summary written by a batch run
+BATCH_SUMMARY_FILENAME = "media_extraction_batch_summary.json"
+
+def load_batch_manifest(manifest_path):
+    """
+    Load the list of books to extract in a batch run.
+
+    The manifest is a JSON list (or an object with a "books" list) of objects with
+    'xml_folder' and 'output_folder' keys and optional 'book_xml', 'media_folder'
+    and 'name' keys. Relative paths are relative to the manifest file.
+
+    Args:
+        manifest_path (str): Path of the manifest file
+
+    Returns:
+        list: Book dicts with all five keys, paths resolved
+    """
+    with open(manifest_path, 'r') as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get('books')
+    if not isinstance(entries, list):
+        raise ValueError(f"Batch manifest {manifest_path} must contain a list of books")
+    
+    base_folder = os.path.dirname(os.path.abspath(manifest_path))
+    
+    def resolve(path):
+        return os.path.join(base_folder, path) if path else None
+    
+    books = []
+    for number, entry in enumerate(entries, 1):
+        if not entry.get('xml_folder') or not entry.get('output_folder'):
+            raise ValueError(f"Book {number} in {manifest_path} needs an xml_folder and an output_folder")
+        books.append({
+            'name': entry.get('name') or entry['output_folder'],
+            'xml_folder': resolve(entry['xml_folder']),
+            'output_folder': resolve(entry['output_folder']),
+            'book_xml': resolve(entry.get('book_xml')),
+            'media_folder': resolve(entry.get('media_folder')),
+        })
+    return books
+
+def parse_shard(text):
+    """
+    Parse a shard given as I/N, where I counts from 0 to N - 1.
+
+    Returns:
+        tuple: (shard_index, shard_count)
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{text}', expected I/N such as 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{text}', I must be between 0 and N - 1")
+    return index, count
+
+def run_batch(books, options, shard=(0, 1), summary_path=BATCH_SUMMARY_FILENAME):
+    """
+    Extract several books in this process, sharing one parse worker pool and the caches.
+
+    Book page maps are shared through the page index, and the interpreter, imports
+    and worker processes are only started once. Books are assigned to shards
+    round-robin in manifest order, so every shard of the same manifest gets a
+    disjoint, stable set of books. A failing book is recorded and the batch goes on.
+
+    Args:
+        books (list): Book dicts from load_batch_manifest
+        options (dict): Keyword arguments for extract_media_from_xml
+        shard (tuple, optional): (shard_index, shard_count) selecting the books to run
+        summary_path (str, optional): Where to write the aggregate summary as JSON
+
+    Returns:
+        dict: The aggregate summary
+    """
+    shard_index, shard_count = shard
+    selected = [book for number, book in enumerate(books) if number % shard_count == shard_index]
+    workers = options.get('workers', 1)
+    
+    results = []
+    batch_started = time.perf_counter()
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker,
+                                       initargs=(None, None))
+    try:
+        for number, book in enumerate(selected, 1):
+            print(f"[{number}/{len(selected)}] Extracting {book['name']}")
+            progress = {}
+            started = time.perf_counter()
+            result = {'name': book['name'], 'xml_folder': book['xml_folder'],
+                      'output_folder': book['output_folder'], 'status': 'ok', 'error': None}
+            try:
+                extract_media_from_xml(book['xml_folder'], book['output_folder'], book['book_xml'],
+                                       book['media_folder'], executor=executor, progress=progress, **options)
+            except Exception as e:
+                result['status'] = 'error'
+                result['error'] = str(e)
+                print(f"Error extracting {book['name']}: {str(e)}")
+            result.update({
+                'xml_files': progress.get('files_total', 0),
+                'media_found': progress.get('media_found', 0),
+                'references': progress.get('references', 0),
+                'bytes_copied': progress.get('bytes_copied', 0),
+                'seconds': time.perf_counter() - started,
+            })
+            results.append(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    ok_results = [result for result in results if result['status'] == 'ok']
+    summary = {
+        'shard': f"{shard_index}/{shard_count}",
+        'books_in_manifest': len(books),
+        'books': results,
+        'totals': {
+            'books': len(results),
+            'succeeded': len(ok_results),
+            'failed': len(results) - len(ok_results),
+            'xml_files': sum(result['xml_files'] for result in ok_results),
+            'media_found': sum(result['media_found'] for result in ok_results),
+            'references': sum(result['references'] for result in ok_results),
+            'bytes_copied': sum(result['bytes_copied'] for result in ok_results),
+            'seconds': time.perf_counter() - batch_started,
+        },
+    }
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def batch_main(argv):
+    """Command-line entry point of the batch subcommand; returns the exit code."""
+    parser = argparse.ArgumentParser(prog='media_extraction.py batch',
+                                     description='Extract media references from several books in one process')
+    parser.add_argument('manifest', help='JSON manifest listing xml_folder, output_folder, book_xml and media_folder per book')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), metavar='I/N',
+                        help='Only run every N-th book of the manifest, starting at book I (0-based, default: 0/1)')
+    parser.add_argument('--summary', help=f'Where to write the aggregate summary (default: {BATCH_SUMMARY_FILENAME}, '
+                                          'with the shard added when sharding)')
+    _add_extraction_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    
+    summary_path = args.summary
+    if summary_path is None:
+        shard_index, shard_count = args.shard
+        summary_path = BATCH_SUMMARY_FILENAME
+        if shard_count > 1:
+            summary_path = BATCH_SUMMARY_FILENAME.replace('.json', f"_shard_{shard_index}_of_{shard_count}.json")
+    
+    books = load_batch_manifest(args.manifest)
+    summary = run_batch(books, _extraction_options(args), args.shard, summary_path)
+    
+    totals = summary['totals']
+    print(f"Batch {summary['shard']}: {totals['succeeded']}/{totals['books']} books extracted, "
+          f"{totals['xml_files']} XML files, {totals['references']} media references, "
+          f"{totals['bytes_copied']} bytes copied in {totals['seconds']:.1f}s")
+    print(f"Batch summary saved to {summary_path}")
+    return 1 if totals['failed'] else 0
+
 def main():
-    parser = argparse.ArgumentParser(description='Extract media references from XML files')
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(batch_main(sys.argv[2:]))
+    
+    parser = argparse.ArgumentParser(description='Extract media references from XML files',
+                                     epilog='Run "%(prog)s batch --help" to extract several books in one process.')
     parser.add_argument('xml_folder', help='Folder containing XML files')
     parser.add_argument('output_folder', help='Folder to save extraction results')
     parser.add_argument('--book-xml', help='Path to the book XML file containing page titles')
     parser.add_argument('--media-folder', help='Optional folder containing the actual media files')
+    _add_extraction_arguments(parser)
+    parser.add_argument('--async-io', action='store_true',
+                        help='Read, parse and copy files in a pipeline of concurrent asyncio stages')
+    parser.add_argument('--read-workers', type=int, default=DEFAULT_READ_WORKERS,
+                        help=f'With --async-io, number of XML files read concurrently (default: {DEFAULT_READ_WORKERS})')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'With --async-io, maximum number of XML files between listing and the report '
+                             f'(default: {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--read-buffer-mb', type=int, default=DEFAULT_READ_BUFFER_BYTES // (1024 * 1024),
+                        help='With --async-io, maximum megabytes of XML read ahead of the parser; larger files '
+                             f'are streamed instead (default: {DEFAULT_READ_BUFFER_BYTES // (1024 * 1024)})')
+    parser.add_argument('--cross-check-parsers', action='store_true',
+                        help='Instead of extracting, parse the XML files with every parser backend and '
+                             'compare the results with etree')
     
     args = parser.parse_args()
     
-    extract_media_from_xml(args.xml_folder, args.output_folder, args.book_xml, args.media_folder)
+    if args.cross_check_parsers:
+        rules = load_rules(args.rules) if args.rules else list(DEFAULT_RULES)
+        results = cross_check_parsers(args.xml_folder, args.output_folder, args.book_xml, rules + (args.rule or []))
+        sys.exit(1 if any(counts['mismatches'] for counts in results['parsers'].values()) else 0)
+    
+    options = _extraction_options(args)
+    if args.async_io:
+        import asyncio
+        asyncio.run(extract_media_async(args.xml_folder, args.output_folder, args.book_xml, args.media_folder,
+                                        read_workers=args.read_workers, queue_size=args.queue_size,
+                                        read_buffer_bytes=args.read_buffer_mb * 1024 * 1024, **options))
+    else:
+        extract_media_from_xml(args.xml_folder, args.output_folder, args.book_xml, args.media_folder, **options)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,9 +2,350 @@ import streamlit as st
 import os
 import tempfile
 import shutil
-from media_extraction import extract_media_from_xml
+from media_extraction import extract_media_from_xml, list_xml_inputs, close_archive, write_results_archive
+from media_export import available_export_formats, export_path
 import zipfile
-import io
+import time
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds between progress refreshes while a job is running
+JOB_POLL_INTERVAL = 1.0
+
+# Size of one page of the report shown in the app; the full report is only downloaded
+REPORT_PAGE_BYTES = 64 * 1024
+
+# Finished jobs are deleted, files and all, once no session has shown them for this long
+JOB_TTL_SECONDS = 60 * 60
+
+# Most finished jobs kept; beyond this the least recently shown ones are deleted
+MAX_FINISHED_JOBS = 16
+
+# Largest file offered for download. Streamlit serves downloads from memory, so
+# larger results are only available from the command line
+DOWNLOAD_MAX_BYTES = 200 * 1024 * 1024
+
+# Report line labels of the built-in media types, used for the summary table
+MEDIA_TYPE_LABELS = {"image": "Images", "video": "Videos", "audio": "Audio"}
+
+# Download options that need an extra export format, with its MIME type
+EXPORT_DOWNLOADS = {
+    "JSON Lines of Media References": ("jsonl", "application/x-ndjson"),
+    "Parquet of Media References": ("parquet", "application/vnd.apache.parquet"),
+}
+
+@st.cache_resource
+def get_job_executor():
+    """Worker pool shared by all sessions for running extractions in the background."""
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def get_job_registry():
+    """Extraction jobs shared by all sessions, keyed by job ID, and the lock guarding them."""
+    return {"lock": threading.Lock(), "jobs": {}}
+
+def upload_digest(upload_mode, uploads, export_formats):
+    """
+    Hash the uploaded files together with the options that change the results.
+
+    Args:
+        upload_mode (str): Upload method chosen in the app
+        uploads (list): (role, uploaded files) pairs, e.g. ("xml", uploaded_xml_files)
+        export_formats (list): Export formats the job writes
+
+    Returns:
+        str: Hex digest, the same for the same uploads and options
+    """
+    digest = hashlib.sha256(repr((upload_mode, sorted(export_formats))).encode())
+    for role, uploaded_files in uploads:
+        for uploaded_file in uploaded_files:
+            digest.update(f"{role}:{uploaded_file.name}:{uploaded_file.size}\n".encode())
+            digest.update(uploaded_file.getbuffer())
+    return digest.hexdigest()
+
+def attach_shared_job(digest):
+    """
+    Show an existing job for the same uploads in this session instead of extracting again.
+
+    Jobs that are still running or finished successfully are reused, whichever
+    session started them; failed jobs are not.
+
+    Returns:
+        str: ID of the reused job, or None if there is none
+    """
+    registry = get_job_registry()
+    with registry["lock"]:
+        job = next((job for job in registry["jobs"].values() if job["digest"] == digest
+                    and not (job["future"].done() and job["future"].exception() is not None)), None)
+        if job is None:
+            return None
+        jobs = st.session_state.setdefault("jobs", {})
+        if job["job_id"] not in jobs:
+            jobs[job["job_id"]] = job
+            job["sessions"] += 1
+        job["last_seen"] = time.time()
+        return job["job_id"]
+
+def start_extraction_job(temp_dir, xml_folder, output_folder, book_xml_path, media_folder, xml_count,
+                         export_formats=('csv',), digest=None):
+    """Submit an extraction to the worker pool and remember it in the session state and job registry."""
+    progress = {}
+    future = get_job_executor().submit(
+        extract_media_from_xml,
+        xml_folder,
+        output_folder,
+        book_xml_path,
+        media_folder,
+        progress=progress,
+        export_formats=export_formats,
+        # Counts come from the progress counters, so the references aren't kept in memory
+        return_references=False
+    )
+    job_id = uuid.uuid4().hex[:8]
+    job = {
+        "job_id": job_id,
+        "future": future,
+        "progress": progress,
+        "temp_dir": temp_dir,
+        "output_folder": output_folder,
+        "xml_count": xml_count,
+        "digest": digest,
+        # Number of sessions showing the job; its files are deleted when the last one discards it
+        "sessions": 1,
+        # When a session last showed the job, see evict_stale_jobs
+        "last_seen": time.time(),
+    }
+    st.session_state.setdefault("jobs", {})[job_id] = job
+    registry = get_job_registry()
+    with registry["lock"]:
+        registry["jobs"][job_id] = job
+    return job_id
+
+def evict_stale_jobs():
+    """
+    Delete finished jobs no session has shown for JOB_TTL_SECONDS, and the least
+    recently shown ones beyond MAX_FINISHED_JOBS.
+
+    A browser that is just closed never discards its jobs, so without this their
+    uploads and results would stay on disk as long as the server runs. Sessions
+    still holding an evicted job show it as expired.
+    """
+    now = time.time()
+    registry = get_job_registry()
+    with registry["lock"]:
+        finished = sorted((job for job in registry["jobs"].values() if job["future"].done()),
+                          key=lambda job: job["last_seen"], reverse=True)
+        evicted = [job for number, job in enumerate(finished)
+                   if number >= MAX_FINISHED_JOBS or now - job["last_seen"] > JOB_TTL_SECONDS]
+        for job in evicted:
+            del registry["jobs"][job["job_id"]]
+            job["evicted"] = True
+    for job in evicted:
+        shutil.rmtree(job["temp_dir"], ignore_errors=True)
+
+@st.cache_data(max_entries=64)
+def read_report_page(report_path, page):
+    """
+    Read one page of a report without loading the whole file.
+
+    Pages are REPORT_PAGE_BYTES long and extended to whole lines, so each line
+    shows up on exactly one page. Reports are complete once their job finishes,
+    so pages are cached and reruns don't read them again.
+
+    Args:
+        report_path (str): Path of the report
+        page (int): Page number, starting at 1
+
+    Returns:
+        tuple: (page_text, page_count)
+    """
+    page_count = max(1, -(-os.path.getsize(report_path) // REPORT_PAGE_BYTES))
+    start = (min(max(page, 1), page_count) - 1) * REPORT_PAGE_BYTES
+    with open(report_path, "rb") as f:
+        if start:
+            # Skip the line that started on the previous page
+            f.seek(start - 1)
+            f.readline()
+        end = start + REPORT_PAGE_BYTES
+        lines = []
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line)
+    return b"".join(lines).decode("utf-8", errors="replace"), page_count
+
+def summary_rows(progress):
+    """Build the summary table rows from the counters the extraction kept while running."""
+    type_counts = progress.get("type_counts") or {}
+    media_by_type = progress.get("media_by_type") or {}
+    media_types = list(MEDIA_TYPE_LABELS) + sorted(set(type_counts) - set(MEDIA_TYPE_LABELS))
+    return [
+        {
+            "Media type": MEDIA_TYPE_LABELS.get(media_type, media_type.capitalize()),
+            "Unique references": type_counts.get(media_type, 0),
+            "Occurrences": media_by_type.get(media_type, 0),
+        }
+        for media_type in media_types
+    ]
+
+def discard_job(job_id):
+    """Forget a finished job, deleting its temporary files unless another session still shows it."""
+    job = st.session_state["jobs"].pop(job_id)
+    registry = get_job_registry()
+    with registry["lock"]:
+        job["sessions"] -= 1
+        if job["sessions"] > 0:
+            return
+        registry["jobs"].pop(job_id, None)
+    shutil.rmtree(job["temp_dir"], ignore_errors=True)
+
+def folder_size(folder):
+    """Return the total size in bytes of the files in a folder tree."""
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(folder) for file in files)
+
+def too_large_to_download(label, size):
+    """Warn and return True when a file is larger than DOWNLOAD_MAX_BYTES."""
+    if size <= DOWNLOAD_MAX_BYTES:
+        return False
+    st.warning(f"{label} is too large to download from the app ({size / 1024 ** 2:.0f} MB, the limit is "
+               f"{DOWNLOAD_MAX_BYTES // 1024 ** 2} MB). Run media_extraction.py from the command line "
+               "for results this large.")
+    return True
+
+def offer_download(label, path, mime, key, build=None, estimate_size=None):
+    """
+    Show a download button for a results file, but only in the run where it is asked for.
+
+    Streamlit reads the data of a download button into its in-memory file store on
+    every run that shows the button, so a large file attached on every rerun would
+    sit in memory the whole time. A "Prepare" button is shown instead, and the file
+    is only attached in the run where it is clicked. Progress polling is skipped in
+    that run, so the download button stays up until it is used. Even then the whole
+    file is copied into memory, so files larger than DOWNLOAD_MAX_BYTES are refused.
+
+    Args:
+        label (str): Name of the file kind shown on the buttons, e.g. "CSV"
+        path (str): Path of the file
+        mime (str): MIME type of the download
+        key (str): Widget key of the download button
+        build (callable, optional): Writes the file at path if it doesn't exist yet
+        estimate_size (callable, optional): Returns the expected size of the file
+            before it is built, so files that would be too large aren't built
+    """
+    if os.path.exists(path) and too_large_to_download(label, os.path.getsize(path)):
+        return
+    if not st.button(f"Prepare {label}", key=f"prepare_{key}"):
+        return
+    if build is not None and not os.path.exists(path):
+        if estimate_size is not None and too_large_to_download(label, estimate_size()):
+            return
+        build()
+        if too_large_to_download(label, os.path.getsize(path)):
+            return
+    with open(path, "rb") as f:
+        st.download_button(
+            label=f"Download {label}",
+            data=f,
+            file_name=os.path.basename(path),
+            mime=mime,
+            key=key
+        )
+    st.session_state["download_offered"] = True
+
+def render_job(job_id, job, download_options):
+    """Show live progress for a running job, or the report and downloads of a finished one."""
+    future = job["future"]
+    progress = job["progress"]
+    output_folder = job["output_folder"]
+    
+    st.subheader(f"Extraction Job {job_id}")
+    
+    if not future.done():
+        files_total = progress.get("files_total") or job["xml_count"]
+        files_parsed = progress.get("files_parsed", 0)
+        st.progress(files_parsed / files_total if files_total else 0.0,
+                    text=f"{progress.get('stage', 'queued').capitalize()}...")
+        st.write(f"Files parsed: {files_parsed}/{files_total} | "
+                 f"Media found: {progress.get('media_found', 0)} | "
+                 f"Bytes copied: {progress.get('bytes_copied', 0)}")
+        media_by_type = progress.get("media_by_type") or {}
+        if media_by_type:
+            st.caption(" | ".join(f"{media_type}: {count}" for media_type, count in media_by_type.items()))
+        return
+    
+    if future.exception() is not None:
+        st.error(f"Extraction failed: {future.exception()}")
+    else:
+        # Display results
+        report_path = os.path.join(output_folder, "media_extraction_report.txt")
+        csv_path = os.path.join(output_folder, "media_references.csv")
+        
+        # Summary table from the counters kept during the run
+        st.subheader("Summary")
+        st.table(summary_rows(progress))
+        if "media_copied" in progress:
+            st.write(f"Media copied: {progress['media_copied']} | Missing: {progress['media_missing']} | "
+                     f"Bytes written: {progress.get('bytes_copied', 0)}")
+        
+        # Show the report a page at a time; large books produce reports far too big for one text area
+        if os.path.exists(report_path):
+            st.subheader("Extraction Report")
+            page_count = read_report_page(report_path, 1)[1]
+            page = 1
+            if page_count > 1:
+                page = st.number_input(f"Report page (of {page_count}, last page holds the summary)",
+                                       min_value=1, max_value=page_count, value=page_count,
+                                       key=f"report_page_{job_id}")
+            report_text, _ = read_report_page(report_path, page)
+            st.text_area("Report", report_text, height=400, key=f"report_{job_id}_{page}")
+        
+        # Create a download section
+        st.subheader("Download Results")
+        
+        # Downloads section
+        download_col1, download_col2, download_col3 = st.columns(3)
+        
+        # CSV Download
+        if "CSV of Media References" in download_options and os.path.exists(csv_path):
+            with download_col1:
+                offer_download("CSV", csv_path, "text/csv", f"csv_{job_id}")
+        
+        # JSON Lines and Parquet Downloads, when they were exported
+        for option, (export_format, mime) in EXPORT_DOWNLOADS.items():
+            path = export_path(output_folder, export_format)
+            if option in download_options and os.path.exists(path):
+                with download_col1:
+                    offer_download(export_format.upper(), path, mime, f"{export_format}_{job_id}")
+        
+        # Report Download
+        if "Extraction Report" in download_options and os.path.exists(report_path):
+            with download_col2:
+                offer_download("Report", report_path, "text/plain", f"report_download_{job_id}")
+        
+        # ZIP Download (all files)
+        if "All Files (ZIP)" in download_options:
+            with download_col3:
+                # The archive is only built when asked for, then kept for later downloads
+                zip_path = os.path.join(job["temp_dir"], "media_extraction_results.zip")
+                
+                def build_zip():
+                    with st.spinner("Building ZIP..."):
+                        write_results_archive(output_folder, zip_path + ".part")
+                        os.replace(zip_path + ".part", zip_path)
+                
+                offer_download("ZIP", zip_path, "application/zip", f"zip_{job_id}", build=build_zip,
+                               estimate_size=lambda: folder_size(output_folder))
+        
+        media_count = progress.get("references", 0)
+        st.success(f"Successfully processed {job['xml_count']} XML files and found {media_count} media references!")
+    
+    # Results stay available across reruns until the user discards them
+    if st.button("Discard results", key=f"discard_{job_id}"):
+        discard_job(job_id)
+        st.rerun()
 
 st.set_page_config(
     page_title="XML Media Extractor",
@@ -60,9 +401,13 @@ with tab1:
     
     with col2:
         st.subheader("Output Options")
+        # Formats whose packages aren't installed, such as Parquet without pyarrow, aren't offered
+        available_formats = available_export_formats()
+        export_options = [option for option, (export_format, _) in EXPORT_DOWNLOADS.items()
+                          if export_format in available_formats]
         download_options = st.multiselect(
             "Select download options", 
-            ["CSV of Media References", "Extraction Report", "All Files (ZIP)"],
+            ["CSV of Media References", *export_options, "Extraction Report", "All Files (ZIP)"],
             default=["CSV of Media References"]
         )
         
@@ -71,6 +416,7 @@ with tab1:
         The extraction will generate:
         - A complete report of all media references found in the XML files
         - A CSV file with all media metadata including source filenames, titles, and pages
+          (also as JSON Lines or Parquet if selected above)
         - If you uploaded media files: organized copies of those files by type and page
         """)
         
@@ -85,168 +431,92 @@ with tab1:
         
     if st.button("Extract Media", type="primary", disabled=process_button_disabled):
         with st.spinner("Processing files..."):
-            # Create temporary directories
-            temp_dir = tempfile.mkdtemp()
-            xml_folder = os.path.join(temp_dir, "xml")
-            media_folder = os.path.join(temp_dir, "media") if include_media else None
-            output_folder = os.path.join(temp_dir, "output")
-            
-            os.makedirs(xml_folder, exist_ok=True)
-            if media_folder:
-                os.makedirs(media_folder, exist_ok=True)
-            os.makedirs(output_folder, exist_ok=True)
+            # The CSV is always written; other formats only when they will be downloaded
+            export_formats = ['csv'] + [export_format for option, (export_format, _) in EXPORT_DOWNLOADS.items()
+                                        if option in download_options]
             
-            # Handle individual files or zip files based on upload mode
+            # Identical uploads reuse the results of an earlier job instead of extracting again
             if upload_mode == "Individual Files":
-                # Save uploaded XML files
-                for xml_file in uploaded_xml_files:
-                    with open(os.path.join(xml_folder, xml_file.name), "wb") as f:
-                        f.write(xml_file.getbuffer())
-                
-                # Save media files if provided and opted in
-                if include_media and uploaded_media:
-                    for media_file in uploaded_media:
-                        with open(os.path.join(media_folder, media_file.name), "wb") as f:
-                            f.write(media_file.getbuffer())
+                uploads = [("xml", uploaded_xml_files), ("media", (include_media and uploaded_media) or [])]
             else:
-                # Extract XML zip file
-                if uploaded_xml_zip:
-                    with zipfile.ZipFile(io.BytesIO(uploaded_xml_zip.getvalue())) as zip_ref:
-                        # Extract only XML files
-                        for file in zip_ref.namelist():
-                            if file.lower().endswith('.xml') and not file.startswith('__MACOSX/') and not file.startswith('.'):
-                                # Extract the file
-                                zip_ref.extract(file, xml_folder)
-                    
-                    # Move XML files from any subdirectories to the xml_folder
-                    for root, _, files in os.walk(xml_folder):
-                        if root != xml_folder:
-                            for file in files:
-                                if file.lower().endswith('.xml'):
-                                    src_path = os.path.join(root, file)
-                                    dst_path = os.path.join(xml_folder, file)
-                                    # Rename if file already exists
-                                    counter = 1
-                                    base, ext = os.path.splitext(dst_path)
-                                    while os.path.exists(dst_path):
-                                        dst_path = f"{base}_{counter}{ext}"
-                                        counter += 1
-                                    shutil.move(src_path, dst_path)
-                
-                # Extract media zip file if provided and opted in
-                if include_media and uploaded_media_zip:
-                    with zipfile.ZipFile(io.BytesIO(uploaded_media_zip.getvalue())) as zip_ref:
-                        # Extract media files with common extensions
-                        media_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.mp3', '.wav', '.ogg')
-                        for file in zip_ref.namelist():
-                            if file.lower().endswith(media_extensions) and not file.startswith('__MACOSX/') and not file.startswith('.'):
-                                # Extract the file
-                                zip_ref.extract(file, media_folder)
-                    
-                    # Move media files from any subdirectories to the media_folder
-                    for root, _, files in os.walk(media_folder):
-                        if root != media_folder:
-                            for file in files:
-                                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.mp3', '.wav', '.ogg')):
-                                    src_path = os.path.join(root, file)
-                                    dst_path = os.path.join(media_folder, file)
-                                    # Rename if file already exists
-                                    counter = 1
-                                    base, ext = os.path.splitext(dst_path)
-                                    while os.path.exists(dst_path):
-                                        dst_path = f"{base}_{counter}{ext}"
-                                        counter += 1
-                                    shutil.move(src_path, dst_path)
-            
-            # Save book XML if provided
-            book_xml_path = None
-            if uploaded_book_xml:
-                book_xml_path = os.path.join(temp_dir, "book.xml")
-                with open(book_xml_path, "wb") as f:
-                    f.write(uploaded_book_xml.getbuffer())
-            
-            # Count the number of XML files to process
-            xml_files = [f for f in os.listdir(xml_folder) if f.endswith('.xml')]
+                uploads = [("xml", [uploaded_xml_zip]),
+                           ("media", [uploaded_media_zip] if include_media and uploaded_media_zip else [])]
+            uploads.append(("book", [uploaded_book_xml] if uploaded_book_xml else []))
+            digest = upload_digest(upload_mode, uploads, export_formats)
             
-            if not xml_files:
-                st.error("No XML files found! Please check your uploads.")
+            if attach_shared_job(digest) is not None:
+                st.info("These files were already extracted with the same options; showing the existing results.")
             else:
-                # Run extraction
-                with st.status(f"Processing {len(xml_files)} XML files..."):
-                    st.write("Starting media extraction...")
-                    media_references = extract_media_from_xml(
-                        xml_folder, 
-                        output_folder, 
-                        book_xml_path, 
-                        media_folder
-                    )
-                    st.write("Extraction complete!")
-                
-                # Display results
-                report_path = os.path.join(output_folder, "media_extraction_report.txt")
-                csv_path = os.path.join(output_folder, "media_references.csv")
-                
-                if os.path.exists(report_path):
-                    with open(report_path, "r") as f:
-                        report_text = f.read()
-                        st.subheader("Extraction Report")
-                        st.text_area("Report", report_text, height=400)
-                
-                # Create a download section
-                st.subheader("Download Results")
-                
-                # Downloads section
-                download_col1, download_col2, download_col3 = st.columns(3)
-                
-                # CSV Download
-                if "CSV of Media References" in download_options and os.path.exists(csv_path):
-                    with open(csv_path, "r") as f:
-                        csv_data = f.read()
-                        with download_col1:
-                            st.download_button(
-                                label="Download CSV",
-                                data=csv_data,
-                                file_name="media_references.csv",
-                                mime="text/csv"
-                            )
+                # Create temporary directories
+                temp_dir = tempfile.mkdtemp()
+                output_folder = os.path.join(temp_dir, "output")
+                os.makedirs(output_folder, exist_ok=True)
+            
+                # Handle individual files or zip files based on upload mode
+                if upload_mode == "Individual Files":
+                    xml_folder = os.path.join(temp_dir, "xml")
+                    media_folder = os.path.join(temp_dir, "media") if include_media else None
                 
-                # Report Download
-                if "Extraction Report" in download_options and os.path.exists(report_path):
-                    with open(report_path, "r") as f:
-                        report_data = f.read()
-                        with download_col2:
-                            st.download_button(
-                                label="Download Report",
-                                data=report_data,
-                                file_name="media_extraction_report.txt",
-                                mime="text/plain"
-                            )
+                    os.makedirs(xml_folder, exist_ok=True)
+                    if media_folder:
+                        os.makedirs(media_folder, exist_ok=True)
                 
-                # ZIP Download (all files)
-                if "All Files (ZIP)" in download_options:
-                    with download_col3:
-                        # Create a ZIP file with all outputs
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                            for root, _, files in os.walk(output_folder):
-                                for file in files:
-                                    file_path = os.path.join(root, file)
-                                    arc_name = os.path.relpath(file_path, output_folder)
-                                    zip_file.write(file_path, arc_name)
-                        
-                        zip_buffer.seek(0)
-                        st.download_button(
-                            label="Download ZIP",
-                            data=zip_buffer,
-                            file_name="media_extraction_results.zip",
-                            mime="application/zip"
-                        )
+                    # Save uploaded XML files
+                    for xml_file in uploaded_xml_files:
+                        with open(os.path.join(xml_folder, xml_file.name), "wb") as f:
+                            f.write(xml_file.getbuffer())
                 
-                # Clean up temp directory (do this after the download buttons are created)
-                shutil.rmtree(temp_dir)
+                    # Save media files if provided and opted in
+                    if include_media and uploaded_media:
+                        for media_file in uploaded_media:
+                            with open(os.path.join(media_folder, media_file.name), "wb") as f:
+                                f.write(media_file.getbuffer())
+                else:
+                    # Keep the archives as they are. XML entries are parsed straight from the
+                    # zip, and only media files that are actually referenced get extracted.
+                    xml_folder = os.path.join(temp_dir, "xml.zip")
+                    with open(xml_folder, "wb") as f:
+                        f.write(uploaded_xml_zip.getbuffer())
                 
-                media_count = len(media_references) if media_references else 0
-                st.success(f"Successfully processed {len(xml_files)} XML files and found {media_count} media references!")
+                    media_folder = None
+                    if include_media and uploaded_media_zip:
+                        media_folder = os.path.join(temp_dir, "media.zip")
+                        with open(media_folder, "wb") as f:
+                            f.write(uploaded_media_zip.getbuffer())
+            
+                # Save book XML if provided
+                book_xml_path = None
+                if uploaded_book_xml:
+                    book_xml_path = os.path.join(temp_dir, "book.xml")
+                    with open(book_xml_path, "wb") as f:
+                        f.write(uploaded_book_xml.getbuffer())
+            
+                # Count the number of XML files to process
+                try:
+                    xml_files = [xml_file for xml_file, _ in list_xml_inputs(xml_folder)]
+                except (zipfile.BadZipFile, OSError):
+                    xml_files = []
+                finally:
+                    close_archive(xml_folder)
+            
+                if not xml_files:
+                    st.error("No XML files found! Please check your uploads.")
+                    shutil.rmtree(temp_dir)
+                else:
+                    # Run extraction in the background so the session stays responsive
+                    start_extraction_job(temp_dir, xml_folder, output_folder, book_xml_path,
+                                         media_folder, len(xml_files), export_formats, digest)
+    
+    # Show progress of running jobs and results of finished ones, newest first
+    evict_stale_jobs()
+    jobs = st.session_state.get("jobs", {})
+    for job_id in reversed(list(jobs)):
+        if jobs[job_id].get("evicted"):
+            del jobs[job_id]
+            st.info(f"The results of extraction job {job_id} expired and were deleted.")
+            continue
+        jobs[job_id]["last_seen"] = time.time()
+        render_job(job_id, jobs[job_id], download_options)
 
 with tab2:
     st.subheader("About XML Media Extractor")
@@ -274,4 +544,11 @@ with tab2:
     still generate a complete report with all media filenames, titles, and page associations.
     """)
 
-    st.info("This app is based on the media_extraction.py script.") 
\ No newline at end of file
+    st.info("This app is based on the media_extraction.py script.") 
+
+# Poll for progress while any extraction job is still running, except in a run that
+# offers a download, since the rerun would take the download button away again
+download_offered = st.session_state.pop("download_offered", False)
+if not download_offered and any(not job["future"].done() for job in st.session_state.get("jobs", {}).values()):
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
@@ -0,0 +1,338 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+
+# Media node tags used by the generator, with the file extension of their sources
+SYNTHETIC_MEDIA = [
+    ('image_node', 'jpg'),
+    ('video_node', 'mp4'),
+    ('audio_node', 'mp3'),
+]
+
+FILLER_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+
+# Code run in a fresh interpreter to time importing each entry point; the app
+# entry point is what the Streamlit server loads before the first page is shown
+IMPORT_PROBES = {
+    'cli': "import media_extraction",
+    'app': "import streamlit, media_extraction, media_export",
+}
+
+# Code run in a fresh interpreter to time the first render of the app page
+APP_RENDER_PROBE = (
+    "from streamlit.testing.v1 import AppTest\n"
+    "start = time.perf_counter()\n"
+    "AppTest.from_file('media_extraction_app.py', default_timeout=60).run()\n"
+)
+
+def generate_synthetic_book(root_folder, file_count=100, file_size_kb=16, nesting_depth=3,
+                            media_per_file=10, media_file_count=200, media_size_kb=32, seed=0):
+    """
+    Generate a synthetic book export for benchmarking.
+
+    Creates root_folder/xml/ with one page XML per page, root_folder/book.xml with the
+    page titles, and root_folder/media/ with the media files the pages reference.
+
+    Args:
+        root_folder (str): Folder to create the book in
+        file_count (int, optional): Number of page XML files
+        file_size_kb (int, optional): Approximate size of each page XML, padded with text nodes
+        nesting_depth (int, optional): Number of section elements wrapped around each media node
+        media_per_file (int, optional): Number of media nodes in each page XML
+        media_file_count (int, optional): Number of distinct media files that pages refer to
+        media_size_kb (int, optional): Size of each media file
+        seed (int, optional): Random seed, so the same parameters give the same book
+
+    Returns:
+        dict: Paths of the generated 'xml_folder', 'book_xml' and 'media_folder'
+    """
+    rng = random.Random(seed)
+    xml_folder = os.path.join(root_folder, "xml")
+    media_folder = os.path.join(root_folder, "media")
+    book_xml_path = os.path.join(root_folder, "book.xml")
+    os.makedirs(xml_folder, exist_ok=True)
+    os.makedirs(media_folder, exist_ok=True)
+
+    media_names = []
+    for index in range(media_file_count):
+        tag, extension = SYNTHETIC_MEDIA[index % len(SYNTHETIC_MEDIA)]
+        name = f"media_{index:06d}.{extension}"
+        media_names.append((tag, name))
+        with open(os.path.join(media_folder, name), 'wb') as f:
+            f.write(rng.randbytes(media_size_kb * 1024))
+
+    filler = f"<text_node>{FILLER_TEXT * 16}</text_node>"
+    with open(book_xml_path, 'w') as book:
+        book.write('<book>\n')
+        for page in range(file_count):
+            # Mostly numeric page titles with some text ones, like real books
+            title = str(page + 1) if page % 10 else f"Chapter {page // 10 + 1}"
+            book.write(f'  <section><page_node id="page-{page}" title="{title}"/></section>\n')
+
+            parts = [f'<root>\n<page_node id="page-{page}" title="Page {page}"/>\n']
+            for _ in range(media_per_file if media_names else 0):
+                tag, name = rng.choice(media_names)
+                opening = "<section>" * nesting_depth
+                closing = "</section>" * nesting_depth
+                parts.append(f'{opening}<{tag} src="media/{name}" title="Media in page {page}"/>{closing}\n')
+            size = sum(len(part) for part in parts)
+            while size < file_size_kb * 1024:
+                parts.append(filler + "\n")
+                size += len(filler) + 1
+            parts.append('</root>\n')
+
+            with open(os.path.join(xml_folder, f"page_{page:06d}.xml"), 'w') as f:
+                f.write(''.join(parts))
+        book.write('</book>\n')
+
+    return {'xml_folder': xml_folder, 'book_xml': book_xml_path, 'media_folder': media_folder}
+
+def _run_child(cli_args):
+    """
+    Run the CLI entry point in this process and print timing and peak memory as JSON.
+
+    This is what each benchmark subprocess executes, so every measurement starts
+    from a fresh interpreter and the peak RSS belongs to a single run.
+    """
+    import resource
+
+    start = time.perf_counter()
+    import media_extraction
+    imported = time.perf_counter()
+
+    sys.argv = ['media_extraction.py'] + cli_args
+    media_extraction.main()
+    finished = time.perf_counter()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    print(json.dumps({
+        'import_seconds': imported - start,
+        'run_seconds': finished - imported,
+        'peak_rss_bytes': max_rss,
+    }))
+
+def _measure_cli(cli_args):
+    """Run the CLI entry point in a fresh interpreter and return its measurements."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--'] + cli_args
+    result = subprocess.run(command, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    # The measurements are the last line; anything before it is the CLI's own output
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def _time_python(code):
+    """Run code in a fresh interpreter from this folder and return its wall time in seconds."""
+    timed = f"import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', timed], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+def measure_cold_start(work_folder, repeat=3, extra_args=None):
+    """
+    Measure how quickly each entry point starts and produces its first result.
+
+    For the CLI this is the import time of media_extraction and the wall time of a
+    whole run on a one-page book, interpreter start included. For the app it is the
+    import time of Streamlit and the extraction modules, and the time until the
+    page is first rendered; these are None when Streamlit is not installed.
+
+    Args:
+        work_folder (str): Scratch folder for the one-page book and its outputs
+        repeat (int, optional): Number of repetitions, the best is reported
+        extra_args (list, optional): Extra CLI arguments, e.g. ['--async-io']
+
+    Returns:
+        dict: Import and first-result seconds of both entry points
+    """
+    book = generate_synthetic_book(os.path.join(work_folder, "cold_start"), file_count=1,
+                                   media_file_count=3, media_size_kb=1)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_extraction.py")
+    output_folder = os.path.join(work_folder, "cold_start_output")
+    has_app = importlib.util.find_spec('streamlit') is not None
+
+    first_results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, book['xml_folder'], output_folder,
+                        '--book-xml', book['book_xml']] + list(extra_args or []),
+                       capture_output=True, check=True)
+        first_results.append(time.perf_counter() - start)
+        shutil.rmtree(output_folder)
+
+    return {
+        'cli_import_seconds': min(_time_python(IMPORT_PROBES['cli']) for _ in range(repeat)),
+        'cli_first_result_seconds': min(first_results),
+        'app_import_seconds': min(_time_python(IMPORT_PROBES['app']) for _ in range(repeat)) if has_app else None,
+        'app_first_render_seconds': min(_time_python(APP_RENDER_PROBE) for _ in range(repeat)) if has_app else None,
+    }
+
+def _count_references(output_folder):
+    """Count the media references listed per file in the report written by a run."""
+    with open(os.path.join(output_folder, "media_extraction_report.txt"), 'r') as f:
+        return sum(1 for line in f if line.startswith("  - "))
+
+def _bytes_written(output_folder):
+    """Read the bytes written by the copy stage from the report."""
+    with open(os.path.join(output_folder, "media_extraction_report.txt"), 'r') as f:
+        for line in f:
+            if line.startswith("Bytes written:"):
+                return int(line.split()[2])
+    return 0
+
+def _copy_stage_seconds(output_folder):
+    """Read the wall time of the copy stage from the metrics a profiled run exported."""
+    with open(os.path.join(output_folder, 'media_extraction_metrics.json'), 'r') as f:
+        return json.load(f)['stages']['copy']['wall_seconds']
+
+def run_benchmark(book, work_folder, repeat=3, extra_args=None):
+    """
+    Benchmark the CLI entry point on a generated book.
+
+    Each repetition runs the CLI twice in a fresh interpreter: once without media
+    (parsing and report only) and once with the media folder (including the copy
+    stage). The best repetition is reported for each. The media run is profiled, so
+    copy throughput comes from the wall time of its copy stage alone.
+
+    Args:
+        book (dict): Paths returned by generate_synthetic_book
+        work_folder (str): Scratch folder for the outputs
+        repeat (int, optional): Number of repetitions
+        extra_args (list, optional): Extra CLI arguments, e.g. ['--workers', '4']
+
+    Returns:
+        dict: Files/sec, references/sec, peak RSS and copy bytes/sec with raw timings
+    """
+    extra_args = list(extra_args or [])
+    file_count = sum(1 for f in os.listdir(book['xml_folder']) if f.endswith('.xml'))
+    parse_runs = []
+    copy_runs = []
+
+    for index in range(repeat):
+        parse_output = os.path.join(work_folder, f"parse_{index}")
+        copy_output = os.path.join(work_folder, f"copy_{index}")
+        base_args = ['--book-xml', book['book_xml']] + extra_args
+
+        parse_runs.append(_measure_cli([book['xml_folder'], parse_output] + base_args))
+        copy_run = _measure_cli([book['xml_folder'], copy_output,
+                                 '--media-folder', book['media_folder'], '--profile'] + base_args)
+        copy_run['copy_seconds'] = _copy_stage_seconds(copy_output)
+        copy_runs.append(copy_run)
+        references = _count_references(parse_output)
+        copy_bytes = _bytes_written(copy_output)
+        shutil.rmtree(parse_output)
+        shutil.rmtree(copy_output)
+
+    best_parse = min(parse_runs, key=lambda run: run['run_seconds'])
+    copy_seconds = min(run['copy_seconds'] for run in copy_runs)
+
+    return {
+        'xml_files': file_count,
+        'references': references,
+        'files_per_sec': file_count / best_parse['run_seconds'],
+        'references_per_sec': references / best_parse['run_seconds'],
+        'peak_rss_bytes': max(run['peak_rss_bytes'] for run in parse_runs + copy_runs),
+        'copy_bytes': copy_bytes,
+        'copy_bytes_per_sec': copy_bytes / copy_seconds,
+        'parse_runs': parse_runs,
+        'copy_runs': copy_runs,
+    }
+
+def compare_results(previous, current):
+    """Print how the throughput, memory and cold start figures changed between two result files."""
+    for key in ('files_per_sec', 'references_per_sec', 'copy_bytes_per_sec', 'peak_rss_bytes'):
+        before = previous['results'].get(key)
+        after = current['results'].get(key)
+        if before:
+            print(f"{key}: {before:.1f} -> {after:.1f} ({(after - before) / before:+.1%})")
+    for key in ('cli_import_seconds', 'cli_first_result_seconds', 'app_import_seconds', 'app_first_render_seconds'):
+        before = previous['results'].get(key)
+        after = current['results'].get(key)
+        if before and after:
+            print(f"{key}: {before:.3f} -> {after:.3f} ({(after - before) / before:+.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark media extraction on a synthetic book')
+    parser.add_argument('--files', type=int, default=100, help='Number of page XML files (default: 100)')
+    parser.add_argument('--file-size', type=int, default=16, help='Approximate page XML size in KB (default: 16)')
+    parser.add_argument('--depth', type=int, default=3, help='Nesting depth of media nodes (default: 3)')
+    parser.add_argument('--media-per-file', type=int, default=10, help='Media nodes per page XML (default: 10)')
+    parser.add_argument('--media-files', type=int, default=200, help='Number of distinct media files (default: 200)')
+    parser.add_argument('--media-size', type=int, default=32, help='Size of each media file in KB (default: 32)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generator (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (default: 3)')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to save the results as JSON')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--keep', help='Generate the book into this folder and keep it')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('extract_args', nargs=argparse.REMAINDER,
+                        help='Extra arguments for media_extraction.py, after --')
+
+    args = parser.parse_args()
+    extract_args = args.extract_args[1:] if args.extract_args[:1] == ['--'] else args.extract_args
+
+    if args.child:
+        _run_child(extract_args)
+        return
+
+    parameters = {
+        'files': args.files,
+        'file_size_kb': args.file_size,
+        'depth': args.depth,
+        'media_per_file': args.media_per_file,
+        'media_files': args.media_files,
+        'media_size_kb': args.media_size,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'extract_args': extract_args,
+    }
+
+    work_folder = tempfile.mkdtemp(prefix="media_extraction_benchmark_")
+    try:
+        book_folder = args.keep or os.path.join(work_folder, "book")
+        book = generate_synthetic_book(
+            book_folder, args.files, args.file_size, args.depth, args.media_per_file,
+            args.media_files, args.media_size, args.seed
+        )
+        results = run_benchmark(book, work_folder, args.repeat, extract_args)
+        results.update(measure_cold_start(work_folder, args.repeat, extract_args))
+    finally:
+        shutil.rmtree(work_folder)
+
+    output = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+
+    print(f"Files/sec: {results['files_per_sec']:.1f}")
+    print(f"References/sec: {results['references_per_sec']:.1f}")
+    print(f"Peak RSS: {results['peak_rss_bytes'] / (1024 * 1024):.1f} MB")
+    print(f"Copy bytes/sec: {results['copy_bytes_per_sec'] / (1024 * 1024):.1f} MB/s")
+    print(f"CLI import: {results['cli_import_seconds'] * 1000:.0f} ms, "
+          f"first result: {results['cli_first_result_seconds'] * 1000:.0f} ms")
+    if results['app_import_seconds'] is not None:
+        print(f"App import: {results['app_import_seconds'] * 1000:.0f} ms, "
+              f"first render: {results['app_first_render_seconds'] * 1000:.0f} ms")
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(json.load(f), output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import io
+import codecs
+import os
+import re
+import xml.etree.ElementTree as ET
+
+# Parser backends, by the name used with --parser. 'auto' uses lxml when it is installed
+# and etree otherwise; 'scan' is the memory-mapped scanner.
+PARSERS = ('auto', 'etree', 'lxml', 'scan')
+
+class ParserFallback(Exception):
+    """Raised by the scanner for a document it cannot parse exactly like ElementTree."""
+
+def lxml_available():
+    """Check whether the optional lxml package is installed, without importing it."""
+    import importlib.util
+    return importlib.util.find_spec('lxml') is not None
+
+def resolve_parser(parser='auto'):
+    """
+    Turn a --parser choice into the backend that will actually be used.
+
+    Args:
+        parser (str, optional): One of PARSERS
+
+    Returns:
+        str: 'etree', 'lxml' or 'scan'; lxml falls back to etree when it is not installed
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser: {parser}")
+    if parser in ('auto', 'lxml'):
+        if lxml_available():
+            return 'lxml'
+        if parser == 'lxml':
+            print("lxml is not installed, parsing with etree instead")
+        return 'etree'
+    return parser
+
+def _matching_elements(events, tags):
+    """
+    Yield (depth, tag, attrib) from lxml iterparse start and end events, freeing elements as they close.
+
+    Only the root element and elements whose tag is in tags are yielded. Once an
+    element closes it is cleared and detached from its parent, so memory stays
+    bounded by the nesting depth rather than the file size.
+    """
+    stack = []
+    for event, elem in events:
+        if event == 'start':
+            if not stack or elem.tag in tags:
+                yield len(stack), elem.tag, dict(elem.attrib)
+            stack.append(elem)
+        else:
+            stack.pop()
+            # Free the finished element and drop it from its parent
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+
+class _ElementCollector:
+    """
+    XMLParser target collecting the root element and elements whose tag is in tags.
+
+    Only start and end tags are handled and the depth is a counter, so no
+    elements are built and memory doesn't grow with the document.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.depth = 0
+        self.elements = []
+
+    def start(self, tag, attrib):
+        if not self.depth or tag in self.tags:
+            self.elements.append((self.depth, tag, attrib))
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+
+    def close(self):
+        return None
+
+# Bytes fed to ElementTree's parser at a time
+_FEED_SIZE = 64 * 1024
+
+def _etree_elements(xml_source, tags):
+    """Stream matching elements with xml.etree.ElementTree.XMLParser, a chunk of the document at a time."""
+    collector = _ElementCollector(tags)
+    parser = ET.XMLParser(target=collector)
+    owns_source = isinstance(xml_source, (str, os.PathLike))
+    source = open(xml_source, 'rb') if owns_source else xml_source
+    try:
+        while True:
+            data = source.read(_FEED_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            if collector.elements:
+                yield from collector.elements
+                collector.elements = []
+        parser.close()
+        yield from collector.elements
+    finally:
+        if owns_source:
+            source.close()
+
+def _lxml_elements(xml_source, tags):
+    """Stream matching elements with lxml's iterparse, which is compiled against libxml2."""
+    from lxml import etree
+    if isinstance(xml_source, os.PathLike):
+        xml_source = os.fspath(xml_source)
+    # Entities are not expanded and nothing is fetched, like ElementTree; huge_tree
+    # lifts libxml2's limits on text size and depth, which ElementTree doesn't have
+    events = etree.iterparse(xml_source, events=('start', 'end'), resolve_entities=False,
+                             no_network=True, huge_tree=True)
+    return _matching_elements(events, tags)
+
+# ASCII names without a namespace prefix. Other names don't match, so documents using
+# namespaces or non-ASCII tag names are left to ElementTree.
+_NAME = rb'[A-Za-z_][-.0-9A-Za-z_]*'
+_SPACE = rb'[ \t\r\n]'
+
+# One piece of markup: a start tag (name, attributes, self-closing slash), an end tag,
+# a comment, a processing instruction, or any other '<', which is malformed. The kind
+# of markup is the index of its last group, see scan_elements.
+_MARKUP = re.compile(
+    rb'<(?:(' + _NAME + rb')((?:' + _SPACE + rb'+' + _NAME + _SPACE + rb'*=' + _SPACE +
+    rb'*(?:"[^"<]*"|\'[^\'<]*\'))*)' + _SPACE + rb'*(/?)>'
+    rb'|/(' + _NAME + rb')' + _SPACE + rb'*>'
+    rb'|!--(.*?)-->'
+    rb'|\?(' + _NAME + rb')(?:' + _SPACE + rb'.*?)?\?>'
+    rb'|())',
+    re.S
+)
+_START_TAG, _END_TAG, _COMMENT, _PROCESSING_INSTRUCTION = 3, 4, 5, 6
+_ATTRIBUTE = re.compile(r'([A-Za-z_][-.0-9A-Za-z_]*)[ \t\r\n]*=[ \t\r\n]*(?:"([^"]*)"|\'([^\']*)\')')
+_ATTRIBUTE_NAME = re.compile(rb'(' + _NAME + rb')' + _SPACE + rb'*=')
+# An XML declaration in UTF-8; any other declaration is left to ElementTree
+_DECLARATION = re.compile(
+    rb'<\?xml' + _SPACE + rb'+version' + _SPACE + rb'*=' + _SPACE + rb'*(?:"1\.0"|\'1\.0\')'
+    rb'(?:' + _SPACE + rb'+encoding' + _SPACE + rb'*=' + _SPACE + rb'*(?:"(?i:utf-8)"|\'(?i:utf-8)\'))?'
+    rb'(?:' + _SPACE + rb'+standalone' + _SPACE + rb'*=' + _SPACE + rb'*(?:"(?:yes|no)"|\'(?:yes|no)\'))?'
+    + _SPACE + rb'*\?>'
+)
+
+# Control characters, which are not allowed anywhere in an XML document
+_CONTROL_BYTES = [bytes([code]) for code in range(0x20) if code not in (0x9, 0xA, 0xD)]
+# U+FFFE and U+FFFF in UTF-8, which are not allowed either
+_NONCHARACTER_BYTES = (b'\xef\xbf\xbe', b'\xef\xbf\xbf')
+_REFERENCE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+_REFERENCE_BYTES = re.compile(rb'&(?:#(x[0-9a-fA-F]+|[0-9]+)|amp|lt|gt|quot|apos);')
+_PREDEFINED_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# Attribute value normalization: every whitespace character becomes a space
+_ATTRIBUTE_WHITESPACE = str.maketrans('\t\n\r', '   ')
+
+def _is_xml_character(code):
+    """Check whether a code point may appear in an XML document."""
+    return (code in (0x9, 0xA, 0xD) or 0x20 <= code <= 0xD7FF or 0xE000 <= code <= 0xFFFD
+            or 0x10000 <= code <= 0x10FFFF)
+
+def _replace_reference(match):
+    """Replace one entity or character reference in an attribute value."""
+    name = match.group(1)
+    if name[0] != '#':
+        return _PREDEFINED_ENTITIES[name]
+    return chr(int(name[2:], 16) if name[1] == 'x' else int(name[1:]))
+
+def _scan_attributes(raw):
+    """Parse the attributes of a start tag into a dict, normalizing values like an XML parser."""
+    attrib = {}
+    for name, value, single_quoted in _ATTRIBUTE.findall(raw.decode('utf-8')):
+        if name in attrib:
+            raise ParserFallback("duplicate attribute")
+        value = value or single_quoted
+        if '\t' in value or '\n' in value or '\r' in value:
+            # A \r\n line break counts as one character
+            value = value.replace('\r\n', ' ').translate(_ATTRIBUTE_WHITESPACE)
+        if '&' in value:
+            value = _REFERENCE.sub(_replace_reference, value)
+        attrib[name] = value
+    return attrib
+
+def _check_document(data):
+    """
+    Raise ParserFallback for documents with content the scanner doesn't handle.
+
+    The checks use bytes.find, which is much faster than a regular expression
+    over the whole document.
+    """
+    find = data.find
+    if (any(find(byte) >= 0 for byte in _CONTROL_BYTES)
+            or any(find(sequence) >= 0 for sequence in _NONCHARACTER_BYTES)):
+        raise ParserFallback("character not allowed in XML")
+    # Comments are scanned, DTDs and CDATA sections are not. Searching for a single
+    # byte is much faster, so '<!' and ']]>' are found from one of their bytes
+    pos = find(b'!')
+    while pos >= 0:
+        if pos > 0 and data[pos - 1:pos] == b'<' and data[pos + 1:pos + 3] != b'--':
+            raise ParserFallback("DTD or CDATA section")
+        pos = find(b'!', pos + 1)
+    pos = find(b']')
+    while pos >= 0:
+        if data[pos:pos + 3] == b']]>':
+            raise ParserFallback("CDATA section end")
+        pos = find(b']', pos + 1)
+    # Only the predefined entities and references to allowed characters
+    pos = find(b'&')
+    while pos >= 0:
+        reference = _REFERENCE_BYTES.match(data, pos)
+        if reference is None:
+            raise ParserFallback("entity reference")
+        code = reference.group(1)
+        if code and not _is_xml_character(int(code[1:], 16) if code[:1] == b'x' else int(code)):
+            raise ParserFallback("reference to a character not allowed in XML")
+        pos = find(b'&', reference.end())
+    try:
+        codecs.utf_8_decode(data, 'strict', True)
+    except UnicodeDecodeError:
+        raise ParserFallback("not UTF-8")
+
+def scan_elements(data, tags):
+    """
+    Find the root element and the elements whose tag is in tags by scanning the raw bytes.
+
+    No tree is built and only the attributes of matching elements are decoded. The
+    scanner checks the document as far as needed to return what ElementTree would:
+    tags must nest and match, attributes must be quoted and references known. It
+    raises ParserFallback for anything else (namespaces, DTDs, CDATA sections,
+    encodings other than UTF-8, malformed markup), so the caller can hand the
+    document to ElementTree instead.
+
+    Args:
+        data (bytes or mmap): The whole document
+        tags (set): Tags of the elements to return
+
+    Returns:
+        list: (depth, tag, attrib) tuples in document order, the root element first
+    """
+    _check_document(data)
+
+    pos = 3 if data[:3] == b'\xef\xbb\xbf' else 0
+    if data[pos:pos + 5] == b'<?xml':
+        declaration = _DECLARATION.match(data, pos)
+        if declaration is None:
+            raise ParserFallback("XML declaration")
+        pos = declaration.end()
+
+    wanted = {tag.encode('utf-8') for tag in tags}
+    elements = []
+    stack = []
+    root_closed = False
+    for markup in _MARKUP.finditer(data, pos):
+        kind = markup.lastindex
+        # Only whitespace, comments and processing instructions around the root element
+        if not stack and markup.start() > pos and data[pos:markup.start()].strip(b' \t\r\n'):
+            raise ParserFallback("text outside the root element")
+        if kind == _START_TAG:
+            if root_closed:
+                raise ParserFallback("more than one root element")
+            name, attributes, self_closing = markup.group(1, 2, 3)
+            if attributes:
+                if b'xmlns' in attributes:
+                    raise ParserFallback("namespace declaration")
+                if not stack or name in wanted:
+                    elements.append((len(stack), name.decode('utf-8'), _scan_attributes(attributes)))
+                elif attributes.count(b'=') > 1:
+                    # Other elements are only checked for duplicate attributes
+                    names = _ATTRIBUTE_NAME.findall(attributes)
+                    if len(set(names)) != len(names):
+                        raise ParserFallback("duplicate attribute")
+            elif not stack or name in wanted:
+                elements.append((len(stack), name.decode('utf-8'), {}))
+            if self_closing:
+                root_closed = not stack
+            else:
+                stack.append(name)
+        elif kind == _END_TAG:
+            if not stack or stack.pop() != markup.group(4):
+                raise ParserFallback("mismatched end tag")
+            root_closed = not stack
+        elif kind == _COMMENT:
+            comment = markup.group(5)
+            if b'--' in comment or comment.endswith(b'-'):
+                raise ParserFallback("malformed comment")
+        elif kind == _PROCESSING_INSTRUCTION:
+            if markup.group(6).lower() == b'xml':
+                raise ParserFallback("misplaced XML declaration")
+        else:
+            raise ParserFallback("malformed markup")
+        if not stack:
+            pos = markup.end()
+
+    if not root_closed or data[pos:].strip(b' \t\r\n'):
+        raise ParserFallback("incomplete document")
+    return elements
+
+def _read_document(xml_source):
+    """
+    Return the bytes of a document: memory-mapped for files on disk, read otherwise.
+
+    Returns:
+        tuple: (data, close) where close releases the mapping, if any
+    """
+    import mmap
+    if isinstance(xml_source, (str, os.PathLike)):
+        with open(xml_source, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                return b'', None
+            return mapped, mapped.close
+    try:
+        mapped = mmap.mmap(xml_source.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped, mapped.close
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Archive members and in-memory documents
+        return xml_source.read(), None
+
+def iter_elements(xml_source, tags, parser='etree', fallback=True):
+    """
+    Yield the root element and the elements whose tag is in tags, in document order.
+
+    'etree' streams the document with xml.etree.ElementTree. 'lxml' does the same
+    with lxml, and 'scan' reads the bytes once (memory-mapped where possible) and
+    scans them for tags without building a tree. With fallback, a document the lxml
+    or scan backend fails on is parsed again with ElementTree, so the results, and
+    the error raised for a broken document, are always those of ElementTree.
+
+    Args:
+        xml_source (str or file): Path or binary file object of the XML document
+        tags (set): Tags of the elements to yield besides the root
+        parser (str, optional): 'etree', 'lxml' or 'scan', see resolve_parser
+        fallback (bool, optional): Fall back to ElementTree instead of raising
+
+    Returns:
+        iterable: (depth, tag, attrib) tuples, where the root element has depth 0
+    """
+    if parser == 'etree':
+        return _etree_elements(xml_source, tags)
+
+    if parser == 'lxml':
+        try:
+            # Collected first, so a failure halfway through can still fall back
+            return list(_lxml_elements(xml_source, tags))
+        except Exception:
+            if not fallback:
+                raise
+            if hasattr(xml_source, 'seek'):
+                xml_source.seek(0)
+            return _etree_elements(xml_source, tags)
+
+    if parser == 'scan':
+        data, close = _read_document(xml_source)
+        try:
+            return scan_elements(data, tags)
+        except ParserFallback:
+            if not fallback:
+                raise
+        finally:
+            if close is not None:
+                close()
+        if close is None:
+            # Content that was read into memory anyway
+            return _etree_elements(io.BytesIO(data), tags)
+        # A memory-mapped document is streamed again instead of copied into memory
+        if not isinstance(xml_source, (str, os.PathLike)):
+            xml_source.seek(0)
+        return _etree_elements(xml_source, tags)
+
+    raise ValueError(f"Unknown parser: {parser}")
@@ -0,0 +1,91 @@
+import json
+from collections import namedtuple
+
+# One media extraction rule: elements with this tag whose src_attr attribute is set are
+# reported as media_type, titled by their title_attr attribute (None for no title)
+MediaRule = namedtuple('MediaRule', ['tag', 'src_attr', 'title_attr', 'media_type'])
+
+# The media types extracted when no rules are given
+DEFAULT_RULES = (
+    MediaRule('image_node', 'src', 'title', 'image'),
+    MediaRule('video_node', 'src', 'title', 'video'),
+    MediaRule('audio_node', 'src', 'title', 'audio'),
+)
+
+# Rules compiled for matching: dispatch maps each tag to its (src_attr, title_attr,
+# media_type) entries, and media_types lists the types in the order they are reported
+CompiledRules = namedtuple('CompiledRules', ['dispatch', 'media_types'])
+
+def compile_rules(rules=None):
+    """
+    Compile media rules into a single dispatch table keyed by tag.
+
+    Every element is then looked up once, however many rules there are. Several rules
+    may share a tag, for example to extract both the src and the poster of a video.
+
+    Args:
+        rules (list, optional): MediaRule entries; DEFAULT_RULES when not given
+
+    Returns:
+        CompiledRules: Dispatch table and media types in first-rule order
+    """
+    dispatch = {}
+    media_types = []
+    for rule in rules or DEFAULT_RULES:
+        rule = MediaRule(*rule)
+        entry = (rule.src_attr, rule.title_attr, rule.media_type)
+        if entry not in dispatch.get(rule.tag, ()):
+            dispatch[rule.tag] = dispatch.get(rule.tag, ()) + (entry,)
+        if rule.media_type not in media_types:
+            media_types.append(rule.media_type)
+    return CompiledRules(dispatch, tuple(media_types))
+
+def _make_rule(tag, src_attr='src', title_attr='title', media_type=None):
+    """Build a rule, checking that the required fields are set."""
+    if not tag or not src_attr or not media_type:
+        raise ValueError("A media rule needs a tag, a source attribute and a media type")
+    return MediaRule(tag, src_attr, title_attr or None, media_type)
+
+def parse_rule(text):
+    """
+    Parse a rule given on the command line as TAG:SRC_ATTR:TITLE_ATTR:MEDIA_TYPE.
+
+    TITLE_ATTR may be left empty for media without a title, e.g. "video_node:poster::image".
+
+    Args:
+        text (str): Rule specification
+
+    Returns:
+        MediaRule: The parsed rule
+    """
+    parts = text.split(':')
+    if len(parts) != 4:
+        raise ValueError(f"Invalid media rule '{text}', expected TAG:SRC_ATTR:TITLE_ATTR:MEDIA_TYPE")
+    return _make_rule(*parts)
+
+def load_rules(rules_path):
+    """
+    Load media rules from a JSON file.
+
+    The file holds a list of objects with 'tag', 'media_type' and optionally 'src'
+    (default "src") and 'title' (default "title", null for no title) keys.
+
+    Args:
+        rules_path (str): Path of the rules file
+
+    Returns:
+        list: MediaRule entries in file order
+    """
+    with open(rules_path, 'r') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"Media rules file {rules_path} must contain a list of rules")
+
+    rules = []
+    for entry in entries:
+        unknown = set(entry) - {'tag', 'src', 'title', 'media_type'}
+        if unknown:
+            raise ValueError(f"Unknown media rule keys in {rules_path}: {', '.join(sorted(unknown))}")
+        rules.append(_make_rule(entry.get('tag'), entry.get('src', 'src'),
+                                entry.get('title', 'title'), entry.get('media_type')))
+    return rules
@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import media_extraction
+from media_checkpoint import JOURNAL_FILENAME
+from media_extraction import extract_media_from_xml
+
+PAGE_TITLES = ['10', 'Intro', '2', 'Appendix', '7', '7', 'Glossary', '1']
+
+class Interrupted(Exception):
+    """Stands in for the process being killed."""
+
+def interrupt_after(function, calls):
+    """Wrap function so that it raises Interrupted once it has been called calls times."""
+    lock = threading.Lock()
+    count = {'calls': 0}
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            if count['calls'] >= calls:
+                raise Interrupted()
+            count['calls'] += 1
+        return function(*args, **kwargs)
+    wrapper.count = count
+    return wrapper
+
+def counting(function):
+    """Wrap function to count its calls."""
+    lock = threading.Lock()
+    count = {'calls': 0}
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            count['calls'] += 1
+        return function(*args, **kwargs)
+    wrapper.count = count
+    return wrapper
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.xml_folder = os.path.join(self.folder, 'xml')
+        self.media_folder = os.path.join(self.folder, 'media')
+        self.output_folder = os.path.join(self.folder, 'output')
+        self.book_xml = os.path.join(self.folder, 'book.xml')
+        os.makedirs(self.xml_folder)
+        os.makedirs(self.media_folder)
+        for number in range(12):
+            with open(os.path.join(self.media_folder, f"m{number}.jpg"), 'wb') as f:
+                f.write(f"media {number}\n".encode() * (number + 1))
+        for page, title in enumerate(PAGE_TITLES):
+            # Sources are shared between pages, and one is missing from the media folder
+            images = ''.join(f'<image_node src="m{(page * 3 + offset) % 13}.jpg" title="t{offset}"/>'
+                             for offset in range(3))
+            self.write_xml(page, f'<root><page_node id="p{page}"/>{images}</root>')
+        with open(self.book_xml, 'w') as f:
+            pages = ''.join(f'<page_node id="p{page}" title="{title}"/>' for page, title in enumerate(PAGE_TITLES))
+            f.write(f'<book>{pages}</book>')
+
+    def write_xml(self, page, content):
+        with open(os.path.join(self.xml_folder, f"page{page}.xml"), 'w') as f:
+            f.write(content)
+
+    def extract(self, **options):
+        options = dict(dict(copy_workers=1, page_index_folder=False, return_references=False), **options)
+        extract_media_from_xml(self.xml_folder, self.output_folder, self.book_xml, self.media_folder, **options)
+
+    def outputs(self):
+        """Return the content of every file in the output folder by relative path, then empty it."""
+        contents = {}
+        for root, _, files in os.walk(self.output_folder):
+            for file in files:
+                path = os.path.join(root, file)
+                with open(path, 'rb') as f:
+                    contents[os.path.relpath(path, self.output_folder)] = f.read()
+        shutil.rmtree(self.output_folder)
+        return contents
+
+    def test_resume_after_interrupted_copy(self):
+        self.extract()
+        expected = self.outputs()
+
+        place = interrupt_after(media_extraction.place_media_file, 5)
+        with mock.patch.object(media_extraction, 'place_media_file', place), self.assertRaises(Interrupted):
+            self.extract()
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, JOURNAL_FILENAME)))
+
+        place = counting(media_extraction.place_media_file)
+        with mock.patch.object(media_extraction, 'place_media_file', place):
+            self.extract(resume=True)
+        total = sum(1 for path in expected if path.startswith(('media' + os.sep, 'media_by_page' + os.sep)))
+        # The files placed before the interruption are not placed again
+        self.assertEqual(place.count['calls'], total - 5)
+        self.assertEqual(self.outputs(), expected)
+
+    def test_resume_after_interrupted_parse(self):
+        self.extract()
+        expected = self.outputs()
+
+        parse = interrupt_after(media_extraction._parse_xml_file, 3)
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse), self.assertRaises(Interrupted):
+            self.extract()
+
+        parse = counting(media_extraction._parse_xml_file)
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse):
+            self.extract(resume=True)
+        self.assertEqual(parse.count['calls'], len(PAGE_TITLES) - 3)
+        self.assertEqual(self.outputs(), expected)
+
+    def test_changed_file_is_parsed_again(self):
+        parsed = []
+
+        def parse(xml_input, *args, **kwargs):
+            if len(parsed) == 3:
+                raise Interrupted()
+            parsed.append(xml_input)
+            return real_parse(xml_input, *args, **kwargs)
+        real_parse = media_extraction._parse_xml_file
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse), self.assertRaises(Interrupted):
+            self.extract()
+
+        # A file parsed before the interruption changes before the run is resumed
+        changed = parsed[0]
+        with open(changed, 'w') as f:
+            f.write('<root><page_node id="p0"/><image_node src="m11.jpg" title="changed"/></root>')
+        parse = counting(real_parse)
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse):
+            self.extract(resume=True)
+        self.assertEqual(parse.count['calls'], len(PAGE_TITLES) - 2)
+        resumed = self.outputs()
+
+        self.extract()
+        self.assertEqual(resumed, self.outputs())
+
+    def test_journal_ignored_with_other_options(self):
+        parse = interrupt_after(media_extraction._parse_xml_file, 3)
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse), self.assertRaises(Interrupted):
+            self.extract()
+
+        parse = counting(media_extraction._parse_xml_file)
+        with mock.patch.object(media_extraction, '_parse_xml_file', parse):
+            self.extract(resume=True, link_mode='hardlink')
+        self.assertEqual(parse.count['calls'], len(PAGE_TITLES))
+        resumed = self.outputs()
+
+        self.extract(link_mode='hardlink')
+        self.assertEqual(resumed, self.outputs())
+
+if __name__ == '__main__':
+    unittest.main()
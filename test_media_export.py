@@ -0,0 +1,89 @@
+import os
+import random
+import tempfile
+import unittest
+
+from media_export import ExternalSorter
+from media_extraction import MediaReference, page_title_sort_key, sort_media_references
+
+PAGE_TITLES = ['1', '2', '10', '100', '9a', 'Intro', 'intro', 'Appendix', '', ' 7 ', '007']
+
+def random_references(count, sources, seed):
+    """Return (src, reference) pairs where many sources occur more than once, with different pages."""
+    rng = random.Random(seed)
+    pairs = []
+    for number in range(count):
+        src = f"media/{rng.randrange(sources)}.jpg"
+        page_title = rng.choice(PAGE_TITLES)
+        pairs.append((src, MediaReference('image', f"title {number}", f"{number}.xml", str(number), page_title)))
+    return pairs
+
+def baseline_order(pairs):
+    """Sort like extract_media_from_xml did with a dict: the last reference wins, at the first position."""
+    media_references = {}
+    for src, reference in pairs:
+        media_references[src] = reference
+    return [(src, tuple(reference)) for src, reference in sort_media_references(media_references).items()]
+
+class ExternalSorterTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def sort(self, pairs, run_size):
+        with ExternalSorter(page_title_sort_key, run_size=run_size, temp_folder=self.folder) as sorter:
+            for src, reference in pairs:
+                sorter.add(src, reference)
+            spilled = sorter._work_folder is not None
+            sorter.finish()
+            # The sorted references can be iterated more than once
+            first = [(src, tuple(reference)) for src, reference in sorter]
+            second = [(src, tuple(reference)) for src, reference in sorter]
+        self.assertEqual(first, second)
+        return first, spilled
+
+    def test_in_memory_matches_baseline(self):
+        pairs = random_references(500, 120, seed=1)
+        result, spilled = self.sort(pairs, run_size=10000)
+        self.assertFalse(spilled)
+        self.assertEqual(result, baseline_order(pairs))
+
+    def test_spilled_runs_match_baseline(self):
+        for seed, run_size in ((2, 1), (3, 2), (4, 7), (5, 64)):
+            with self.subTest(run_size=run_size):
+                pairs = random_references(500, 120, seed)
+                result, spilled = self.sort(pairs, run_size)
+                self.assertTrue(spilled)
+                self.assertEqual(result, baseline_order(pairs))
+
+    def test_last_reference_wins_at_first_position(self):
+        pairs = [
+            ('a.jpg', MediaReference('image', 'a1', '1.xml', '1', '2')),
+            ('b.jpg', MediaReference('image', 'b', '1.xml', '1', '2')),
+            ('a.jpg', MediaReference('image', 'a2', '2.xml', '2', '2')),
+            ('c.jpg', MediaReference('image', 'c', '2.xml', '2', '1')),
+            ('b.jpg', MediaReference('image', 'b2', '3.xml', '3', '1')),
+        ]
+        expected = [
+            ('b.jpg', ('image', 'b2', '3.xml', '3', '1')),
+            ('c.jpg', ('image', 'c', '2.xml', '2', '1')),
+            ('a.jpg', ('image', 'a2', '2.xml', '2', '2')),
+        ]
+        for run_size in (1, 2, 100):
+            with self.subTest(run_size=run_size):
+                self.assertEqual(self.sort(pairs, run_size)[0], expected)
+                self.assertEqual(baseline_order(pairs), expected)
+
+    def test_empty(self):
+        for run_size in (1, 100):
+            with self.subTest(run_size=run_size):
+                self.assertEqual(self.sort([], run_size)[0], [])
+
+    def test_temporary_files_removed(self):
+        self.sort(random_references(200, 50, seed=6), run_size=3)
+        self.assertEqual(os.listdir(self.folder), [])
+
+if __name__ == '__main__':
+    unittest.main()
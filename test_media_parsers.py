@@ -0,0 +1,123 @@
+import io
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from media_parsers import ParserFallback, _etree_elements, iter_elements, scan_elements
+
+TAGS = {'page', 'img'}
+
+# Documents the scanner has to get right on its own
+SCANNED = {
+    'plain': b'<book><page id="1"><img src="a.png"/></page></book>',
+    'entities and char refs': (
+        b'<book title="a &amp; b &lt;c&gt; &quot;d&quot; &apos;e&apos;">'
+        b'<img src="&#65;&#x42;&#x1F600;.png" alt="caf&#233;"/></book>'),
+    'whitespace in attributes': b'<book><img src="a\r\nb\tc\rd\ne.png" alt=\'x\r\ny\'/></book>',
+    'gt inside attribute values': b'<book><img src="a>b.png" alt="-->" title="/>"/></book>',
+    'comments containing tags': b'<book><!-- <img src="no.png"/> --><img src="yes.png"/><!----></book>',
+    'byte order mark': b'\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?>\n<book><img src="a.png"/></book>',
+    'processing instructions': b'<?xml version="1.0"?><?style href="a"?><book><?pi <img src="no.png"/>?><img src="a.png"/></book><?after?>',
+    'misc around the root': b'\n<!-- before -->\n<book/>\n<!-- after -->\n',
+    'unwanted tags': b'<book><div class="x" id="y"><span>text &amp; more</span></div><img/></book>',
+    'nested wanted tags': b'<page n="1"><page n="2"><img src="a.png"/></page></page>',
+    'non-ascii': '<book><img src="ñ.png" alt="日本"/></book>'.encode('utf-8'),
+}
+
+# Documents the scanner may hand to ElementTree, but must never get wrong
+TRICKY = {
+    'cdata': b'<book><![CDATA[<img src="no.png"/>]]><img src="a.png"/></book>',
+    'doctype': b'<!DOCTYPE book [<!ENTITY e "x">]><book><img alt="&e;"/></book>',
+    'undefined entity': b'<book><img alt="&nbsp;"/></book>',
+    'namespaces': b'<book xmlns:m="urn:m"><m:img src="a.png"/><img m:src="b.png"/></book>',
+    'default namespace': b'<book xmlns="urn:b"><img src="a.png"/></book>',
+    'mismatched tags': b'<book><page><img/></book></page>',
+    'unclosed root': b'<book><img/>',
+    'two roots': b'<book/><book/>',
+    'text after the root': b'<book/>text',
+    'duplicate attribute': b'<book><div a="1" a="2"/></book>',
+    'duplicate wanted attribute': b'<book><img a="1" a="2"/></book>',
+    'unquoted attribute': b'<book><img src=a.png/></book>',
+    'lt in attribute': b'<book><img alt="a<b"/></book>',
+    'invalid char ref': b'<book><img alt="&#0;"/></book>',
+    'char ref in text': b'<book>&#1;</book>',
+    'double hyphen in comment': b'<book><!-- a -- b --></book>',
+    'misplaced declaration': b'<book/><?xml version="1.0"?>',
+    'latin-1': b'<?xml version="1.0" encoding="ISO-8859-1"?><book><img alt="\xe9"/></book>',
+    'invalid utf-8': b'<book><img alt="\xff"/></book>',
+    'control character': b'<book>\x01</book>',
+    'U+FFFE': '<book><img src="a\ufffe.png"/></book>'.encode('utf-8'),
+    'U+FFFF in text': '<book>\uffff<img src="a.png"/></book>'.encode('utf-8'),
+    'empty': b'',
+    'whitespace only': b' \n',
+    'bom only': b'\xef\xbb\xbf',
+}
+
+def etree_result(data):
+    """Return the elements ElementTree finds, or the error it raises."""
+    try:
+        return list(_etree_elements(io.BytesIO(data), TAGS))
+    except ET.ParseError as error:
+        return ('error', str(error))
+
+class ScanMatchesEtreeTest(unittest.TestCase):
+
+    def test_scanned_documents(self):
+        for name, data in SCANNED.items():
+            with self.subTest(name):
+                self.assertEqual(scan_elements(data, TAGS), etree_result(data))
+
+    def test_tricky_documents(self):
+        for name, data in TRICKY.items():
+            with self.subTest(name):
+                try:
+                    elements = scan_elements(data, TAGS)
+                except ParserFallback:
+                    continue
+                self.assertEqual(elements, etree_result(data))
+
+    def test_fallback_gives_etree_result(self):
+        for name, data in {**SCANNED, **TRICKY}.items():
+            with self.subTest(name):
+                try:
+                    elements = list(iter_elements(io.BytesIO(data), TAGS, parser='scan'))
+                except ET.ParseError as error:
+                    elements = ('error', str(error))
+                self.assertEqual(elements, etree_result(data))
+
+    def test_fallback_disabled(self):
+        with self.assertRaises(ParserFallback):
+            iter_elements(io.BytesIO(TRICKY['cdata']), TAGS, parser='scan', fallback=False)
+
+class MappedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def write(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_path_sources(self):
+        for name, data in {**SCANNED, **TRICKY}.items():
+            with self.subTest(name):
+                path = self.write('doc.xml', data)
+                try:
+                    elements = list(iter_elements(path, TAGS, parser='scan'))
+                except ET.ParseError as error:
+                    elements = ('error', str(error))
+                self.assertEqual(elements, etree_result(data))
+
+    def test_file_object_fallback_rereads_file(self):
+        data = TRICKY['cdata']
+        with open(self.write('doc.xml', data), 'rb') as f:
+            elements = list(iter_elements(f, TAGS, parser='scan'))
+        self.assertEqual(elements, etree_result(data))
+
+if __name__ == '__main__':
+    unittest.main()